@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+
+# run from the repository root: python -m benchmarks.run_benchmarks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cardio_playlist import MyCardioBeats, cardio_playlists_ids  # noqa: E402
+from fake_spotify.catalog import generate_catalog  # noqa: E402
+from fake_spotify.client import FakeSpotifyClient  # noqa: E402
+from fake_spotify.server import FakeSpotify  # noqa: E402
+from tempo_cache import TempoCache, setup_django  # noqa: E402
+
+default_sizes = [1000, 10000, 100000]
+default_results_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def use_in_memory_database():
+    """
+    Point the tempo cache at a fresh in-memory database so benchmarks neither read nor fill db.sqlite3
+    """
+    setup_django()
+    from django.conf import settings
+    from django.core.management import call_command
+
+    settings.DATABASES["default"]["NAME"] = ":memory:"
+    call_command("migrate", verbosity=0)
+
+
+class PhaseRecorder:
+    def __init__(self, spotify_client, trace_memory=True):
+        self.spotify_client = spotify_client
+        self.trace_memory = trace_memory
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Record wall time, Spotify calls, peak traced memory and net allocated blocks of the with block
+        """
+        calls_before = dict(self.spotify_client.calls)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            snapshot_before = tracemalloc.take_snapshot()
+
+        start = time.perf_counter()
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            yield
+        wall_seconds = time.perf_counter() - start
+
+        result = {
+            "wall_seconds": round(wall_seconds, 6),
+            "api_calls": {
+                endpoint: count - calls_before.get(endpoint, 0)
+                for endpoint, count in self.spotify_client.calls.items()
+                if count != calls_before.get(endpoint, 0)
+            },
+        }
+        if self.trace_memory:
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            snapshot_after = tracemalloc.take_snapshot()
+            result["allocated_blocks"] = sum(
+                statistic.count_diff
+                for statistic in snapshot_after.compare_to(snapshot_before, "filename")
+            )
+
+        self.phases[name] = result
+
+
+def benchmark_catalog_size(track_count, seed=0, trace_memory=True) -> dict:
+    """
+    Generate a playlist from a synthetic catalog of track_count tracks spread over every cardio playlist
+    """
+    catalog = generate_catalog(track_count, playlist_size=0, seed=seed)
+    track_ids = list(catalog["tracks"])
+    for number, playlist in enumerate(catalog["playlists"].values()):
+        playlist["track_ids"] = track_ids[number::len(catalog["playlists"])]
+
+    spotify_client = FakeSpotifyClient(FakeSpotify(catalog, seed=seed))
+    recorder = PhaseRecorder(spotify_client, trace_memory=trace_memory)
+
+    with redirect_stdout(open(os.devnull, "w")):
+        mcb = MyCardioBeats(
+            intensity="cardio",
+            session_length=60,
+            genres=list(cardio_playlists_ids),
+            spotify_client=spotify_client,
+            tempo_cache=TempoCache(),
+        )
+
+    with recorder.phase("ingestion"):
+        mcb.get_genre_playlist_songs()
+
+    track_ids = list(mcb.track_store)
+    with recorder.phase("tempo_resolution"):
+        mcb.add_track_bpms(track_ids)
+
+    mcb.tempo_cache = TempoCache()
+    with recorder.phase("tempo_resolution_cached"):
+        mcb.tempo_cache.load(track_ids)
+        mcb.get_track_bpms(track_ids)
+
+    with recorder.phase("sequencing"):
+        sorted_tracks = mcb.plan_playlist()
+
+    with recorder.phase("publishing"):
+        mcb.publish_playlist(sorted_tracks)
+
+    return {
+        "tracks": track_count,
+        "playlist_tracks": len(sorted_tracks),
+        "phases": recorder.phases,
+    }
+
+
+def compare(results, baseline):
+    """
+    Print the wall time of every phase relative to a baseline run
+    """
+    baseline_sizes = {str(result["tracks"]): result for result in baseline["results"]}
+    for result in results["results"]:
+        baseline_result = baseline_sizes.get(str(result["tracks"]))
+        if baseline_result is None:
+            continue
+
+        for phase, measurements in result["phases"].items():
+            baseline_measurements = baseline_result["phases"].get(phase)
+            if baseline_measurements is None or baseline_measurements["wall_seconds"] == 0:
+                continue
+
+            ratio = measurements["wall_seconds"] / baseline_measurements["wall_seconds"]
+            print(f"{result['tracks']:>9} {phase:<24} {ratio:6.2f}x baseline wall time")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark ingestion, tempo resolution, sequencing and publishing against an in-process fake Spotify"
+    )
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in default_sizes),
+        help="comma separated catalog sizes, e.g. 1000,1000000",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-tracemalloc", action="store_true", help="measure wall time without memory tracing")
+    parser.add_argument("--output", help="results JSON file; defaults to benchmarks/results/<timestamp>.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="results JSON file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    use_in_memory_database()
+    trace_memory = not args.no_tracemalloc
+    if trace_memory:
+        tracemalloc.start()
+
+    started = datetime.now(timezone.utc)
+    results = {
+        "started": started.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [],
+    }
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print(f"Benchmarking a catalog of {size} tracks...")
+        result = benchmark_catalog_size(size, seed=args.seed, trace_memory=trace_memory)
+        results["results"].append(result)
+        for phase, measurements in result["phases"].items():
+            print(
+                f"{size:>9} {phase:<24} {measurements['wall_seconds']:9.3f}s "
+                f"{sum(measurements['api_calls'].values()):>7} calls "
+                f"{measurements.get('peak_bytes', 0) / 2 ** 20:9.1f} MiB peak"
+            )
+
+    output_path = args.output
+    if output_path is None:
+        os.makedirs(default_results_directory, exist_ok=True)
+        output_path = os.path.join(default_results_directory, started.strftime("%Y%m%dT%H%M%SZ") + ".json")
+    with open(output_path, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {output_path}")
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
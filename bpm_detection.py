@@ -0,0 +1,328 @@
+import argparse
+import multiprocessing
+import numpy as np
+import os
+import shutil
+import subprocess
+import threading
+import wave
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# clips are decoded or downsampled to about this rate; tempo needs nothing above a few kHz
+analysis_sample_rate = 11025
+# onset envelope frames: 512 sample windows every 64 samples, about 172 frames per second
+frame_size = 512
+hop_size = 64
+# tempos looked for, and the tempo the estimate leans towards when a clip fits several
+min_bpm = 60
+max_bpm = 200
+prior_bpm = 120
+# estimates less confident than this are not cached
+default_min_confidence = 0.1
+
+wav_extensions = {".wav", ".wave"}
+# decoded with ffmpeg when it is installed
+ffmpeg_extensions = {".mp3", ".m4a", ".aac", ".ogg", ".oga", ".opus", ".flac"}
+
+
+class TempoEstimate(NamedTuple):
+    bpm: float
+    # peak autocorrelation of the onset envelope, from 0 for no pulse to 1 for a perfectly regular one
+    confidence: float
+
+
+def read_wav(path) -> Tuple[np.ndarray, int]:
+    """
+    Mono float32 samples of the PCM WAV file path, and its sample rate
+    """
+    with wave.open(path, "rb") as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    if sample_width == 1:
+        samples = np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32)
+    elif sample_width == 3:
+        # 24 bit samples, widened to 32 bits by a zero low byte
+        padded = np.zeros((len(frames) // 3, 4), dtype=np.uint8)
+        padded[:, 1:] = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        samples = padded.view("<i4").ravel().astype(np.float32)
+    elif sample_width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32)
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {sample_width} bytes")
+
+    samples = samples[:len(samples) - len(samples) % channels]
+    return samples.reshape(-1, channels).mean(axis=1), sample_rate
+
+
+def decode_with_ffmpeg(path) -> Tuple[np.ndarray, int]:
+    """
+    Mono float32 samples of any audio file ffmpeg can decode, at analysis_sample_rate
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise ValueError(f"ffmpeg is needed to decode {path}")
+
+    decoded = subprocess.run(
+        [ffmpeg, "-v", "error", "-i", path, "-f", "s16le", "-ac", "1", "-ar", str(analysis_sample_rate), "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    return np.frombuffer(decoded.stdout, dtype="<i2").astype(np.float32), analysis_sample_rate
+
+
+def audio_extensions() -> set:
+    return wav_extensions | (ffmpeg_extensions if shutil.which("ffmpeg") else set())
+
+
+def read_audio(path) -> Tuple[np.ndarray, int]:
+    if os.path.splitext(path)[1].lower() in wav_extensions:
+        return read_wav(path)
+    return decode_with_ffmpeg(path)
+
+
+def downsample(samples, sample_rate) -> Tuple[np.ndarray, int]:
+    """
+    Average every factor samples, for the largest factor keeping the rate at or above analysis_sample_rate
+    """
+    factor = max(sample_rate // analysis_sample_rate, 1)
+    if factor == 1:
+        return samples, sample_rate
+
+    samples = samples[:len(samples) - len(samples) % factor]
+    return samples.reshape(-1, factor).mean(axis=1), sample_rate / factor
+
+
+def onset_envelope(samples, sample_rate) -> Tuple[np.ndarray, float]:
+    """
+    Spectral flux of samples: the summed increases in log magnitude of each frame over the one before,
+    high where notes and beats start. Returns the envelope and its frames per second
+    """
+    samples, sample_rate = downsample(samples, sample_rate)
+    frame_count = 1 + (len(samples) - frame_size) // hop_size
+    if frame_count < 2:
+        return np.zeros(0, dtype=np.float32), sample_rate / hop_size
+
+    frames = np.lib.stride_tricks.as_strided(
+        samples,
+        shape=(frame_count, frame_size),
+        strides=(samples.strides[0] * hop_size, samples.strides[0]),
+        writeable=False,
+    )
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(frame_size).astype(np.float32), axis=1))
+    log_spectrum = np.log1p(spectrum / (spectrum.max() or 1.0) * 1000)
+    flux = np.maximum(np.diff(log_spectrum, axis=0), 0).sum(axis=1)
+
+    # remove the slowly changing loudness so that only the onsets are left
+    window = int(sample_rate / hop_size / 2) | 1
+    local_mean = np.convolve(flux, np.ones(window) / window, mode="same")
+    return np.maximum(flux - local_mean, 0), sample_rate / hop_size
+
+
+def estimate_tempo(envelope, frame_rate) -> Optional[TempoEstimate]:
+    """
+    Tempo of the strongest periodicity of envelope between min_bpm and max_bpm, or None for a silent clip.
+    Periodicities are weighted by a log-normal prior around prior_bpm, one octave wide,
+    so that a clip matching both a tempo and its double gets the more common of the two
+    """
+    envelope = envelope - envelope.mean()
+    energy = float(np.dot(envelope, envelope))
+    if len(envelope) == 0 or energy == 0:
+        return None
+
+    # autocorrelation by FFT, zero padded so that it does not wrap around
+    size = 1 << (2 * len(envelope) - 1).bit_length()
+    spectrum = np.fft.rfft(envelope, size)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), size)[:len(envelope)] / energy
+
+    min_lag = max(int(frame_rate * 60 / max_bpm), 1)
+    max_lag = min(int(np.ceil(frame_rate * 60 / min_bpm)), len(envelope) - 2)
+    if max_lag <= min_lag:
+        return None
+
+    lags = np.arange(min_lag, max_lag + 1)
+    prior = np.exp(-0.5 * np.log2(frame_rate * 60 / lags / prior_bpm) ** 2)
+    lag = int(lags[np.argmax(autocorrelation[lags] * prior)])
+
+    # refine the lag between frames with the parabola through the peak and its neighbours
+    before, peak, after = autocorrelation[lag - 1:lag + 2]
+    curvature = before - 2 * peak + after
+    offset = 0.5 * (before - after) / curvature if curvature < 0 else 0.0
+
+    return TempoEstimate(
+        bpm=float(frame_rate * 60 / (lag + offset)),
+        confidence=float(np.clip(peak, 0.0, 1.0)),
+    )
+
+
+def detect_bpm(path) -> Optional[TempoEstimate]:
+    """
+    Estimate the tempo of the audio file path; None when it has no regular pulse
+    """
+    samples, sample_rate = read_audio(path)
+    return estimate_tempo(*onset_envelope(samples, sample_rate))
+
+
+def detect_bpm_or_error(path) -> Tuple[Optional[TempoEstimate], Optional[str]]:
+    # run in the worker processes; errors are returned, so one unreadable file does not fail its whole chunk
+    try:
+        return detect_bpm(path), None
+    except Exception as e:
+        return None, repr(e)
+
+
+executor = None
+executor_lock = threading.Lock()
+
+
+def get_executor(max_workers=None) -> ProcessPoolExecutor:
+    """
+    Return the process pool shared by everything detecting tempos in this process; worker processes are
+    spawned rather than forked, since the threads of the calling process may hold locks
+    """
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return executor
+
+
+def detect_bpms(
+    paths: Iterable[str],
+    max_workers=None,
+    chunk_size=16,
+) -> Iterator[Tuple[str, Optional[TempoEstimate]]]:
+    """
+    Yield (path, estimate) for every file of paths in order, detecting chunk_size files at a time in each
+    worker process. Files that cannot be read are reported and yield None
+    """
+    paths = list(paths)
+    results = get_executor(max_workers).map(detect_bpm_or_error, paths, chunksize=chunk_size)
+    for path, (estimate, error) in zip(paths, results):
+        if error is not None:
+            print(f"Could not detect the tempo of {path}: {error}")
+        yield path, estimate
+
+
+def audio_files(paths: Iterable[str]) -> List[str]:
+    """
+    The audio files of paths, looking inside directories; compressed formats only when ffmpeg is installed
+    """
+    extensions = audio_extensions()
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if os.path.splitext(name)[1].lower() in extensions
+            )
+        else:
+            files.append(path)
+
+    return files
+
+
+def track_id_of(path) -> str:
+    """
+    Clips are named after the Spotify id of their track, e.g. 4uLU6hMCjMI75M1A2tKUQC.wav
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def clip_paths(directory) -> Dict[str, str]:
+    """
+    Track id -> path of every clip in directory
+    """
+    extensions = audio_extensions()
+    return {
+        track_id_of(name): os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if os.path.splitext(name)[1].lower() in extensions
+    }
+
+
+def cache_detected_bpms(
+    tempo_cache,
+    paths: Iterable[str],
+    min_confidence=default_min_confidence,
+    replace_spotify_bpms=False,
+    max_workers=None,
+) -> Dict[str, TempoEstimate]:
+    """
+    Detect the tempos of the clips of paths and cache them in tempo_cache, a tempo_cache.TempoCache.
+    Only tracks already in the cache are updated, since a clip says nothing of the uri or duration of its track;
+    tracks with a bpm from Spotify are left as they are unless replace_spotify_bpms.
+    Returns track id -> estimate of the tracks updated
+    """
+    paths_by_track_id = {track_id_of(path): path for path in paths}
+    tempo_cache.load(list(paths_by_track_id))
+
+    unknown_track_ids = [track_id for track_id in paths_by_track_id if track_id not in tempo_cache]
+    if unknown_track_ids:
+        print(f"Skipping {len(unknown_track_ids)} clips of tracks not in the tempo cache, e.g. {unknown_track_ids[0]}")
+
+    wanted_paths = [
+        path
+        for track_id, path in paths_by_track_id.items()
+        if track_id in tempo_cache and (tempo_cache.tracks.bpm(track_id) is None or replace_spotify_bpms)
+    ]
+
+    cached = {}
+    for path, estimate in detect_bpms(wanted_paths, max_workers=max_workers):
+        if estimate is None or estimate.confidence < min_confidence:
+            continue
+
+        track = tempo_cache.tracks.get(track_id_of(path))
+        tempo_cache.set(
+            track.id,
+            estimate.bpm,
+            uri=track.uri,
+            duration=track.duration,
+            name=track.name,
+            source=tempo_cache.song_model.LOCAL,
+            confidence=estimate.confidence,
+        )
+        cached[track.id] = estimate
+
+    tempo_cache.flush()
+    return cached
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Detect the tempos of audio clips named after their Spotify track ids and cache them "
+                    "for the tracks Spotify has no tempo for"
+    )
+    parser.add_argument("paths", nargs="+", metavar="PATH", help="audio files or directories of them")
+    parser.add_argument("--workers", type=int, help="worker processes; defaults to the number of CPUs")
+    parser.add_argument("--min-confidence", type=float, default=default_min_confidence)
+    parser.add_argument(
+        "--replace-spotify-bpms",
+        action="store_true",
+        help="also replace the bpms Spotify gave tracks with the detected ones"
+    )
+    args = parser.parse_args()
+
+    from tempo_cache import TempoCache
+
+    files = audio_files(args.paths)
+    print(f"Detecting the tempos of {len(files)} clips...")
+    detected = cache_detected_bpms(
+        TempoCache(),
+        files,
+        min_confidence=args.min_confidence,
+        replace_spotify_bpms=args.replace_spotify_bpms,
+        max_workers=args.workers,
+    )
+    print(f"Cached the detected tempos of {len(detected)} tracks")
@@ -1,17 +1,35 @@
-import base64
+import argparse
+import hashlib
 import json
+import numpy as np
 import random
 import re
-import requests
-import spotipy
-import spotipy.util as util
-from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 
-from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date
 from exceptions import ResponseException
-from secrets import client_id, client_secret, user_id, redirect_uri, scopes
-from typing import Optional, Tuple
-from urllib.parse import urlencode
+from functools import cached_property
+from metrics import RunMetrics, get_metrics, profiled
+from plan_cache import CachedPlan, PlanCache, get_plan_cache, plan_key, preset_name
+from playlist_planner import fold_tempos, plan_session, tempo_multiples
+from playlist_publisher import PlaylistPublisher
+from playlist_store import PlaylistStore
+from queue import Queue
+from request_scheduler import BACKGROUND, INTERACTIVE
+from similarity_index import SimilarityIndex, get_similarity_index
+from snapshot_store import SnapshotStore
+from spotify_config import get_credentials, spotify_access_token, spotify_api_url
+from tempo_cache import TempoCache
+from token_manager import Token, TokenManager, TokenManagerAuth, authorize_interactively, cached_spotipy_token
+from track_store import TrackRecord, TrackStore
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional, Tuple
+
+# spotipy and requests take most of the import time and are imported on first use,
+# so that a dry run, the web app and --help start without them
+if TYPE_CHECKING:
+    import requests
+    import spotipy
 
 # from spotify_app.models import Playlist
 
@@ -75,147 +93,155 @@ genre_dict = {
     "soca": "soca",
 }
 
+cardio_bpm_dict = {  # mapping of desired heart rate zones to corresponding min and max BPMs
+    "fat_burn": (120, 141),
+    "cardio": (142, 168),
+    "peak": (169, 210),
+    "f": (120, 141),
+    "c": (142, 168),
+    "p": (169, 210)
+}
 
-class Token:
-    def __init__(self, access_token, expires_in, refresh_token):
-        self.access_token = access_token
-        self.created = datetime.now()
-        self.expires = self.created + timedelta(seconds=expires_in)
-        self.refresh_token = refresh_token
-
-    def update(self, access_token, expires_in):
-        self.access_token = access_token
-        self.last_modified = datetime.now()
-        self.expires = self.last_modified + timedelta(seconds=expires_in)
-
-    def refresh(self):
-        token_url = 'https://accounts.spotify.com/api/token'
-
-        request_body = {
-            "grant_type": "refresh_token",
-            "refresh_token": self.refresh_token,
-        }
-
-        encoded_credentials = base64.b64encode(
-            client_id.encode() + b':' + client_secret.encode()
-        ).decode("utf-8")
-
-        token_headers = {
-            "Authorization": "Basic " + encoded_credentials,
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-
-        token_response = requests.post(
-            token_url,
-            data=request_body,
-            headers=token_headers,
-        )
+# phases of generating a playlist, reported to the on_phase callback of MyCardioBeats
+generation_phases = ("fetch", "tempo", "sequence", "publish")
 
-        if token_response.get("access_token", None) is None:
-            raise Exception("Invalid token response")
+# lifetime given to spotify_access_token, which is never refreshed
+static_token_lifetime_seconds = 365 * 24 * 60 * 60
 
-        self.update(
-            token_response["access_token"],
-            token_response["expires_in"]
-        )
+# only request the track fields that are used, plus the link to the next page
+playlist_track_fields = "items(track(id,uri,duration_ms,name)),next"
 
 
 class MyCardioBeats:
 
-    def __init__(self):
+    def __init__(
+        self,
+        intensity=None,
+        session_length=None,
+        genres=None,
+        spotify_client=None,
+        tempo_cache=None,
+        playlist_tracks_cache=None,
+        playlist_store=None,
+        on_phase: Optional[Callable[[str], None]] = None,
+        plan_cache: Optional[PlanCache] = None,
+        plan_variants=1,
+        snapshot_store: Optional[SnapshotStore] = None,
+        replace_playlist=False,
+        audio_directory=None,
+        similarity_index: Optional[SimilarityIndex] = None,
+    ):
+        """
+        Preferences that are not all given are asked for interactively.
+        spotify_client, tempo_cache and playlist_tracks_cache can be shared between instances
+        so that several playlists are generated with one HTTP session, tempo cache and set of fetched playlists
+        """
         print("Initializing MyCardioBeats instance...")
-        self.user_id = user_id
-        self.client_id = client_id
-        self.token = None
-        self.spotify_client = spotipy.Spotify(
-            auth_manager=SpotifyOAuth(
-                client_id=client_id,
-                client_secret=client_secret,
-                redirect_uri=redirect_uri,
-                scope=scopes,
-                open_browser=True
-            )
-        )
-        self.cardio_bpm_dict = {  # mapping of desired heart rate zones to corresponding min and max BPMs
-            "fat_burn": (120, 141),
-            "cardio": (142, 168),
-            "peak": (169, 210),
-            "f": (120, 141),
-            "c": (142, 168),
-            "p": (169, 210)
-        }
-        self.intensity, self.session_length, self.genres = self.get_user_preferences()
+        # timings and counts of this run, see run_report()
+        self.metrics = RunMetrics()
+        if spotify_client is not None:
+            self.spotify_client = spotify_client
+        self.cardio_bpm_dict = cardio_bpm_dict
+        with self.metrics.phase("preferences"):
+            if intensity is None or session_length is None or genres is None:
+                self.intensity, self.session_length, self.genres = self.get_user_preferences()
+            else:
+                self.intensity, self.session_length, self.genres = self.validate_preferences(
+                    intensity, session_length, genres
+                )
         # 80% of the playlist will include top songs; the rest will be recommended
         self.percent_top_songs = 0.8
         self.avg_song_length_min = 3
         self.additional_song_buffer = 10
-        self.track_info_dict = {}
+        # maximum bpm difference between consecutive songs
+        self.max_bpm_step = 15
+        # how far the playlist length may be from the session length
+        self.session_length_tolerance_ms = 30000
+        self.track_store = TrackStore()
+        self.tempo_cache = tempo_cache if tempo_cache is not None else TempoCache()
+        # playlist id -> pages of TrackRecords already fetched from that playlist
+        self.playlist_tracks_cache = playlist_tracks_cache if playlist_tracks_cache is not None else {}
+        self.playlist_store = playlist_store if playlist_store is not None else PlaylistStore()
+        # called with each of generation_phases as generating the playlist reaches it
+        self.on_phase = on_phase
+        # plans shared with other sessions asking for the same preferences
+        self.plan_cache = plan_cache if plan_cache is not None else get_plan_cache()
+        # number of differently shuffled plans cached per preferences; a session gets one of them at random
+        self.plan_variants = plan_variants
+        self.plan_variant = 0
+        self.snapshot_store = snapshot_store if snapshot_store is not None else SnapshotStore()
+        # genre playlist id -> its snapshot id at the time of this session
+        self.snapshot_ids = {}
+        # genre playlist id -> (snapshot id, track ids) downloaded in this session, saved once their tempos are
+        self.synced_snapshots = {}
+        # reuse the playlist generated before for the same user and preferences instead of creating one
+        self.replace_playlist = replace_playlist
+        self.preset = preset_name(self.intensity, self.session_length, self.genres)
+        # directory of audio clips named after their track ids, see bpm_detection;
+        # the tempos of tracks Spotify has none for are detected from their clips
+        self.audio_directory = audio_directory
+        if similarity_index is not None:
+            self.similarity_index = similarity_index
+        # maximum number of ids accepted by the audio features endpoint
+        self.audio_features_batch_size = 100
+        # uri -> the multiple of its bpm each planned track not planned at its own bpm was planned at
+        self.tempo_multiples = {}
+        # maximum number of tracks per page accepted by the playlist tracks endpoint
+        self.playlist_page_size = 100
+        # maximum number of genre playlists fetched at the same time
+        self.max_concurrent_requests = 4
 
         # self.get_authorization_token()  # oauth_token
 
-    def get_authorization_token(self):
-        # This function is not currently called
-        if self.token is not None:
-            if self.token.expires < datetime.now():
-                self.token.refresh()
-
-            return self.token.access_token
-
-        print("Getting Spotify authorization token...")
-
-        auth_url = 'https://accounts.spotify.com/authorize'
-        token_url = 'https://accounts.spotify.com/api/token'
-
-        state = self.generate_random_string(16)
-
-        auth_headers = {
-            "client_id": client_id,
-            "response_type": "code",
-            "redirect_uri": redirect_uri,
-            "scope": "",
-            "state": state,
-        }
-
-        auth_response = requests.get(
-            auth_url + "?" + urlencode(auth_headers)
-        )
+    @cached_property
+    def user_id(self) -> str:
+        return get_credentials().user_id
 
-        code = auth_response.get("code", None)
-        if code is None:
-            raise Exception("Invalid authorization response")
-
-        encoded_credentials = base64.b64encode(
-            client_id.encode() + b':' + client_secret.encode()
-        ).decode("utf-8")
-
-        token_headers = {
-            "Authorization": "Basic " + encoded_credentials,
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
+    @cached_property
+    def client_id(self) -> Optional[str]:
+        return get_credentials().client_id
 
-        token_data = {
-            "grant_type": "authorization_code",
-            "code": code,
-            "redirect_uri": redirect_uri
-        }
+    @cached_property
+    def spotify_client(self) -> "spotipy.Spotify":
+        """
+        Client authorized for the user, built the first time Spotify is requested
+        """
+        return build_spotify_client(open_browser=True)
 
-        auth_response = requests.post(
-            token_url, data=token_data, headers=token_headers)
+    @cached_property
+    def token_manager(self) -> TokenManager:
+        """
+        Token manager of the requests made without self.spotify_client; the client's own when it has one,
+        so that both share their tokens
+        """
+        auth_manager = getattr(self.spotify_client, "auth_manager", None)
+        if isinstance(auth_manager, TokenManagerAuth):
+            return auth_manager.token_manager
 
-        auth_response_json = auth_response.json()
+        return build_token_manager(interactive=True)
 
-        print(auth_response_json)
+    def get_authorization_token(self) -> str:
+        """
+        Access token of the user, asking the user to authorize the app first when no token is stored
+        """
+        return self.token_manager.get_access_token()
 
-        access_token = auth_response_json.get("access_token", None)
+    def spotify_api_get(self, url, **kwargs) -> "requests.Response":
+        """
+        GET url through the shared session with the current access token, refreshing it and retrying once
+        if Spotify rejects it. Raises ResponseException for unsuccessful responses
+        """
+        from http_session import check_response, get_spotify_session
 
-        if access_token is None:
-            raise Exception("Invalid access token returned")
+        session = get_spotify_session()
+        headers = self.token_manager.headers()
+        response = session.get(url, headers=headers, **kwargs)
+        if response.status_code == 401:
+            access_token = headers["Authorization"][len("Bearer "):]
+            self.token_manager.refresh(access_token)
+            response = session.get(url, headers=self.token_manager.headers(), **kwargs)
 
-        self.token = Token(
-            access_token,
-            auth_response_json["expires_in"],
-            auth_response_json["refresh_token"]
-        )
+        return check_response(response, f"GET {url} failed. ")
 
     def generate_random_string(self, length) -> str:
         # This function is not currently called
@@ -241,6 +267,10 @@ class MyCardioBeats:
         }
 
         genres_string = " ".join([genre.title() for genre in self.genres])
+        self.playlist_name = f"""
+                    My {genres_string} Cardio Beats - 
+                    {intensity_dict.get(self.intensity, '')} - {date.today()}
+                """
         # data = json.dumps(
         #     {
         #         "name": f"""
@@ -256,15 +286,13 @@ class MyCardioBeats:
         # print("Access Token: ", self.token.access_token)
         # print("URL: ", url)
 
-        response = self.spotify_client.user_playlist_create(
-            self.user_id,
-            name=f"""
-                My {genres_string} Cardio Beats - 
-                {intensity_dict.get(self.intensity, '')} - {date.today()}
-            """,
-            public=False,
-            description=f"My {genres_string} Cardio Exercise Playlist",
-        )
+        with request_priority(INTERACTIVE):
+            response = self.spotify_client.user_playlist_create(
+                self.user_id,
+                name=self.playlist_name,
+                public=False,
+                description=f"My {genres_string} Cardio Exercise Playlist",
+            )
 
         # response = requests.post(
         #     url,
@@ -278,13 +306,6 @@ class MyCardioBeats:
         # if response.status_code != 201:
         #     raise ResponseException(response.status_code)
 
-        # response_json = response.json()
-        # playlist_id = response_json["id"]
-        # Playlist.objects.create(
-        #     id=playlist_id,
-        #     name=playlist_name,
-        # )
-
         playlist_id = response.get("id", None)
         if playlist_id is None:
             raise Exception("Error occurred while creating playlist")
@@ -393,6 +414,12 @@ class MyCardioBeats:
 
         return (intensity, int(session_length), [genre_dict.get(genre) for genre in genres])
 
+    def validate_preferences(self, intensity, session_length, genres) -> Tuple[str, int, list]:
+        """
+        Check preferences given without get_user_preferences and return them in the same form it does
+        """
+        return validate_preferences(intensity, session_length, genres)
+
     def get_users_top_songs(self):
         # This function is not currently called
         """
@@ -402,7 +429,7 @@ class MyCardioBeats:
 
         print("Getting user's top songs...")
 
-        url = f"https://api.spotify.com/v1/me/top/tracks"
+        url = f"{spotify_api_url}me/top/tracks"
 
         limit = 20
 
@@ -415,17 +442,11 @@ class MyCardioBeats:
                 self.avg_song_length_min - self.additional_song_buffer
             )
 
-        print("Token: ", self.token.access_token)
-
-        response = requests.get(
-            url=url,
+        response = self.spotify_api_get(
+            url,
             params={
                 "limit": limit,
             },
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.token.access_token}",
-            }
         )
 
         response_json = response.json()
@@ -433,10 +454,7 @@ class MyCardioBeats:
 
         if tracks is not None:
             for track in tracks:
-                self.track_info_dict[track["id"]] = {
-                    "uri": track["uri"],
-                    "duration": track["duration_ms"]
-                }
+                self.track_store.add(track["id"], track["uri"], track["duration_ms"])
 
     def get_genre_playlist_songs(self):
         """
@@ -445,39 +463,158 @@ class MyCardioBeats:
         """
 
         print("Getting songs from preferred genres...")
-        for genre in self.genres:
-            playlist_id = cardio_playlists_ids.get(genre)
+        for track in self.iter_genre_playlist_tracks():
+            self.add_track_info(track)
 
-            # url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
+    def iter_genre_playlist_tracks(self) -> Iterator[TrackRecord]:
+        """
+        Yield the tracks of the users preferred genre playlists as their pages arrive.
+        Genre playlists are downloaded concurrently, at most self.max_concurrent_requests at a time,
+        and yielded in the order the genres were selected. Playlists in self.playlist_tracks_cache are not downloaded again
+        """
+        playlist_ids = self.genre_playlist_ids()
+        self.load_synced_playlists(playlist_ids)
+        page_queues = [Queue() for _ in playlist_ids]
+
+        def download_playlist(playlist_id, page_queue):
+            try:
+                if playlist_id in self.playlist_tracks_cache:
+                    for page in self.playlist_tracks_cache[playlist_id]:
+                        page_queue.put(page)
+                else:
+                    pages = []
+                    for page in self.iter_playlist_track_pages(playlist_id):
+                        pages.append(page)
+                        page_queue.put(page)
+                    self.playlist_tracks_cache[playlist_id] = pages
+                    self.metrics.add("playlists_downloaded")
+                    self.synced_snapshots[playlist_id] = (
+                        self.snapshot_ids[playlist_id],
+                        [track.id for page in pages for track in page],
+                    )
+            except Exception as e:
+                page_queue.put(e)
+            page_queue.put(None)
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_requests) as executor:
+            for playlist_id, page_queue in zip(playlist_ids, page_queues):
+                executor.submit(download_playlist, playlist_id, page_queue)
+
+            for page_queue in page_queues:
+                page = page_queue.get()
+                while page is not None:
+                    if isinstance(page, Exception):
+                        raise page
+
+                    yield from page
+                    page = page_queue.get()
+
+    def genre_playlist_ids(self) -> List[str]:
+        return [
+            cardio_playlists_ids[genre]
+            for genre in dict.fromkeys(self.genres)
+            if genre in cardio_playlists_ids
+        ]
 
-            # limit = 20
+    def fetch_snapshot_ids(self, playlist_ids) -> dict:
+        """
+        Return playlist id -> the current snapshot id of every playlist of playlist_ids,
+        requesting only the snapshot ids not fetched earlier in this session
+        https://developer.spotify.com/documentation/web-api/reference/#/operations/get-playlist
+        """
+        unknown_playlist_ids = [
+            playlist_id
+            for playlist_id in playlist_ids
+            if playlist_id not in self.snapshot_ids
+        ]
 
-            playlist_track_results = self.spotify_client.playlist_tracks(
-                playlist_id,
-                fields="items"
-            )
+        def fetch_snapshot_id(playlist_id):
+            return self.spotify_client.playlist(playlist_id, fields="snapshot_id")["snapshot_id"]
 
-            # response = requests.get(
-            #     url=url,
-            #     params={
-            #         "limit": limit,
-            #     },
-            #     headers={
-            #         "Content-Type": "application/json",
-            #         "Authorization": f"Bearer {self.token.access_token}",
-            #     }
-            # )
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_requests) as executor:
+            self.snapshot_ids.update(zip(
+                unknown_playlist_ids,
+                executor.map(fetch_snapshot_id, unknown_playlist_ids)
+            ))
+
+        return {
+            playlist_id: self.snapshot_ids[playlist_id]
+            for playlist_id in playlist_ids
+        }
+
+    def load_synced_playlists(self, playlist_ids):
+        """
+        Add the playlists of playlist_ids that have not changed since they were last synced
+        to self.playlist_tracks_cache, from self.snapshot_store and the tracks in self.tempo_cache,
+        so that only changed playlists are downloaded
+        """
+        snapshot_ids = self.fetch_snapshot_ids(playlist_ids)
+        stored_snapshots = self.snapshot_store.load(
+            playlist_id
+            for playlist_id in playlist_ids
+            if playlist_id not in self.playlist_tracks_cache
+        )
+
+        for playlist_id, (snapshot_id, track_ids) in stored_snapshots.items():
+            if snapshot_id != snapshot_ids[playlist_id]:
+                continue
+
+            self.tempo_cache.load(track_ids)
+            if all(track_id in self.tempo_cache for track_id in track_ids):
+                self.metrics.add("playlists_unchanged")
+                self.playlist_tracks_cache[playlist_id] = [[
+                    self.tempo_cache.tracks.get(track_id)
+                    for track_id in track_ids
+                ]]
+
+    def iter_playlist_track_pages(self, playlist_id) -> Iterator[List[TrackRecord]]:
+        """
+        Yield the tracks of playlist_id one page at a time, following the next links,
+        requesting only the track fields that are used
+        https://developer.spotify.com/documentation/web-api/reference/#/operations/get-playlists-tracks
+        """
 
-            # response_json = response.json()
-            track_items = playlist_track_results.get("items")
+        # url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
 
-            if track_items is not None:
-                for item in track_items:
-                    track = item["track"]
-                    self.track_info_dict[track["id"]] = {
-                        "uri": track["uri"],
-                        "duration": track["duration_ms"]
-                    }
+        # limit = 20
+
+        playlist_track_results = self.spotify_client.playlist_tracks(
+            playlist_id,
+            fields=playlist_track_fields,
+            limit=self.playlist_page_size
+        )
+
+        # response = requests.get(
+        #     url=url,
+        #     params={
+        #         "limit": limit,
+        #     },
+        #     headers={
+        #         "Content-Type": "application/json",
+        #         "Authorization": f"Bearer {self.token.access_token}",
+        #     }
+        # )
+
+        # response_json = response.json()
+        while playlist_track_results is not None:
+            yield [
+                TrackRecord(
+                    item["track"]["id"],
+                    item["track"]["uri"],
+                    item["track"]["duration_ms"],
+                    item["track"].get("name", ""),
+                )
+                for item in playlist_track_results.get("items") or []
+                if item.get("track") is not None and item["track"].get("id") is not None
+            ]
+
+            if playlist_track_results.get("next") is None:
+                break
+
+            playlist_track_results = self.spotify_client.next(playlist_track_results)
+
+    def add_track_info(self, track: TrackRecord):
+        self.track_store.add(track.id, track.uri, track.duration, track.name)
 
     def get_song_recommendations(self):
         # This function is not currently called
@@ -489,7 +626,7 @@ class MyCardioBeats:
 
         print("Getting song recommendations...")
 
-        top_artists_url = f"https://api.spotify.com/v1/users/{self.user_id}/top/artists"
+        top_artists_url = f"{spotify_api_url}users/{self.user_id}/top/artists"
         limit = 20
 
         if (
@@ -502,17 +639,12 @@ class MyCardioBeats:
                 - self.additional_song_buffer
             )
 
-        top_artists_response = requests.get(
-            url=top_artists_url,
+        top_artists_response = self.spotify_api_get(
+            top_artists_url,
             params={
                 "limit": limit,
                 "time_range": "medium_term"
             },
-            headers={
-                "Accept": "application/json",
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.token.access_token}",
-            }
         )
 
         artists_response_json = top_artists_response.json()
@@ -520,7 +652,7 @@ class MyCardioBeats:
 
         seed_track_ids = [
             track_id
-            for track_id in self.track_info_dict.keys()
+            for track_id in self.track_store
         ]
 
         if artists is not None:
@@ -534,34 +666,29 @@ class MyCardioBeats:
                 for genre in artist["genres"]
             ]
 
-            recommendations_url = "https://api.spotify.com/v1/recommendations"
-            recommendations_response = requests.get(
-                url=recommendations_url,
+            recommendations_url = f"{spotify_api_url}recommendations"
+            recommendations_response = self.spotify_api_get(
+                recommendations_url,
                 data={
                     "seed_artists": seed_artist_ids,
                     "seed_genres": seed_genres,
                     "seed_tracks": seed_track_ids,
                 },
-                headers={
-                    "Accept": "application/json",
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.token.access_token}",
-                }
             )
 
             recommendations_response_json = recommendations_response.json()
 
             tracks = recommendations_response_json.get("tracks")
             for track in tracks:
-                self.track_info_dict[track["id"]] = {
-                    "uri": track["uri"],
-                    "duration": track["duration_ms"]
-                }
+                self.track_store.add(track["id"], track["uri"], track["duration_ms"])
 
-    def get_track_bpm(self, track_id) -> Optional[str]:
-        """https://developer.spotify.com/documentation/web-api/reference/#/operations/get-audio-analysis"""
-
-        print("Getting track bpms")
+    def get_track_bpm(self, track_id) -> Optional[float]:
+        """
+        Return the tempo of track_id from self.tempo_cache, falling back to the audio analysis endpoint
+        https://developer.spotify.com/documentation/web-api/reference/#/operations/get-audio-analysis
+        """
+        if track_id in self.tempo_cache:
+            return self.tempo_cache.get_bpm(track_id)
 
         # url = f"https://api.spotify.com/v1/audio-analysis/{track_id}"
 
@@ -576,16 +703,149 @@ class MyCardioBeats:
 
         # response_json = response.json()
 
-        track_results = self.spotify_client.audio_analysis(track_id)
+        from spotipy import SpotifyException
+
+        bpm = None
+        try:
+            track_results = self.spotify_client.audio_analysis(track_id)
+        except SpotifyException as e:
+            # Spotify has no analysis for some tracks
+            if e.http_status != 404:
+                raise
+            track_results = {}
+
         track = track_results.get("track", None)
         if track is not None:
-            return track["tempo"]
+            bpm = track["tempo"]
 
-        return None
+        self.cache_track_bpm(track_id, bpm)
+
+        return bpm
+
+    def get_track_bpms(self, track_ids) -> dict:
+        """
+        Return a dict of track id to tempo for track_ids, resolving tracks missing from self.tempo_cache
+        with one audio features request per self.audio_features_batch_size tracks.
+        Tracks the audio features endpoint has no tempo for fall back to get_track_bpm
+        https://developer.spotify.com/documentation/web-api/reference/#/operations/get-several-audio-features
+        """
+        track_ids = list(track_ids)
+        self.tempo_cache.load(track_ids)
+
+        uncached_track_ids = [
+            track_id
+            for track_id in track_ids
+            if track_id not in self.tempo_cache
+        ]
+
+        self.metrics.add("tempo_cache_hits", len(track_ids) - len(uncached_track_ids))
+        self.metrics.add("tempo_cache_misses", len(uncached_track_ids))
+        print(f"Getting bpms of {len(uncached_track_ids)} uncached tracks...")
+        # track id -> audio features of the tracks fetched now, indexed once they are cached
+        fetched_features = {}
+        for start in range(0, len(uncached_track_ids), self.audio_features_batch_size):
+            batch_ids = uncached_track_ids[start:start + self.audio_features_batch_size]
+            audio_features = self.spotify_client.audio_features(batch_ids) or []
+
+            for track_id, features in zip(batch_ids, audio_features):
+                if features and features.get("tempo"):
+                    self.cache_track_bpm(track_id, features["tempo"], features=features)
+                    fetched_features[track_id] = features
+
+        bpms = {
+            track_id: self.get_track_bpm(track_id)
+            for track_id in track_ids
+        }
+        self.tempo_cache.flush()
+
+        if fetched_features:
+            self.similarity_index.add_many(
+                list(fetched_features),
+                [features["tempo"] for features in fetched_features.values()],
+                list(fetched_features.values()),
+            )
+
+        return bpms
+
+    def add_track_bpms(self, track_ids):
+        """
+        Add the bpms of track_ids to self.track_store, removing tracks without a bpm.
+        Tempo requests give way to playlist requests of other sessions
+        """
+        with self.metrics.phase("tempo"), request_priority(BACKGROUND):
+            bpms = self.get_track_bpms(track_ids)
+        if self.audio_directory is not None:
+            with self.metrics.phase("tempo_detection"):
+                bpms.update(self.detect_track_bpms(
+                    track_id
+                    for track_id, bpm in bpms.items()
+                    if bpm is None
+                ))
+        for track_id, bpm in bpms.items():
+            if bpm is None:
+                self.track_store.remove(track_id)
+                self.metrics.add("tracks_without_tempo")
+            else:
+                self.track_store.set_bpm(track_id, bpm)
+
+    @cached_property
+    def similarity_index(self) -> SimilarityIndex:
+        """
+        Index of the tracks in the tempo cache by bpm and audio features, shared by the sessions in this process
+        """
+        return get_similarity_index()
+
+    @cached_property
+    def audio_clips(self) -> dict:
+        from bpm_detection import clip_paths
+
+        return clip_paths(self.audio_directory)
+
+    def detect_track_bpms(self, track_ids) -> dict:
+        """
+        Return track id -> tempo detected from the clips in self.audio_directory, for the track_ids with a clip
+        and a confident enough estimate, caching the tempos with their confidence
+        """
+        from bpm_detection import default_min_confidence, detect_bpms
+
+        clips = {
+            track_id: self.audio_clips[track_id]
+            for track_id in track_ids
+            if track_id in self.audio_clips
+        }
+        bpms = {}
+        for track_id, (_, estimate) in zip(clips, detect_bpms(clips.values())):
+            if estimate is None or estimate.confidence < default_min_confidence:
+                continue
+
+            self.cache_track_bpm(
+                track_id,
+                estimate.bpm,
+                source=self.tempo_cache.song_model.LOCAL,
+                confidence=estimate.confidence
+            )
+            bpms[track_id] = estimate.bpm
+
+        self.tempo_cache.flush()
+        self.metrics.add("tempos_detected", len(bpms))
+        return bpms
+
+    def cache_track_bpm(self, track_id, bpm, source=None, confidence=None, features=None):
+        track = self.track_store.get(track_id)
+        self.tempo_cache.set(
+            track_id,
+            bpm,
+            uri=track.uri if track is not None else "",
+            duration=track.duration if track is not None else None,
+            name=track.name if track is not None else "",
+            source=source,
+            confidence=confidence,
+            features=features,
+        )
 
-    def add_songs_to_playlist(self):
+    def add_songs_to_playlist(self) -> Optional[str]:
         """
-        Create list of songs sorted by BPM, create playlist and add songs to playlist
+        Create list of songs sorted by BPM, create playlist, add songs to playlist and return playlist_id
         """
         print("Populating playlist...")
 
@@ -593,123 +853,277 @@ class MyCardioBeats:
         # self.get_users_top_songs()
         # self.get_song_recommendations()
 
-        self.get_genre_playlist_songs()
+        self.plan_variant = random.randrange(self.plan_variants)
+        key = plan_key(
+            self.intensity, self.session_length, self.genres, self.catalog_version(), self.plan_variant
+        )
+        cached_plan = self.plan_cache.get(key)
+        self.metrics.add("plan_cache_hits" if cached_plan is not None else "plan_cache_misses")
+        if cached_plan is not None:
+            print("Reusing the plan of an earlier session with the same preferences...")
+            for track, bpm in zip(cached_plan.tracks, cached_plan.bpms):
+                self.add_track_info(track)
+                self.track_store.set_bpm(track.id, bpm)
+            sorted_tracks = cached_plan.uris
+        else:
+            self.populate_track_info()
+            self.report_phase("sequence")
+            sorted_tracks = self.plan_playlist()
+            self.plan_cache.set(key, self.planned_tracks(sorted_tracks))
+
+        self.report_phase("publish")
+        return self.publish_playlist(sorted_tracks)
+
+    def plan_from_local_cache(self) -> List[str]:
+        """
+        Plan the playlist from the genre playlists as they were last synced and the tempos in self.tempo_cache,
+        without any Spotify request or authorization, print it and return the uris of its tracks in order.
+        Genres never synced by an earlier run have no tracks to plan from
+        """
+        self.report_phase("fetch")
+        playlist_ids = self.genre_playlist_ids()
+        with self.metrics.phase("ingestion"):
+            stored_snapshots = self.snapshot_store.load(playlist_ids)
+            for genre in dict.fromkeys(self.genres):
+                if cardio_playlists_ids.get(genre) not in stored_snapshots:
+                    print(f"No synced tracks of {genre}; generate a playlist with it once to sync them")
+
+            for _, track_ids in stored_snapshots.values():
+                self.tempo_cache.load(track_ids)
+                for track_id in track_ids:
+                    if track_id not in self.tempo_cache or track_id in self.track_store:
+                        continue
+
+                    bpm = self.tempo_cache.get_bpm(track_id)
+                    if bpm is not None:
+                        self.add_track_info(self.tempo_cache.tracks.get(track_id))
+                        self.track_store.set_bpm(track_id, bpm)
+        self.metrics.set("tracks_ingested", len(self.track_store))
+
+        self.report_phase("sequence")
+        sorted_tracks = self.plan_playlist()
+
+        rows = self.track_store.rows_of_uris(sorted_tracks).tolist()
+        for position, row in enumerate(rows, start=1):
+            minutes, seconds = divmod(int(self.track_store.durations[row]) // 1000, 60)
+            multiple = self.tempo_multiples.get(self.track_store.uris[row], 1)
+            print(
+                f"{position:>4} {self.track_store.bpms[row] * multiple:6.1f} bpm "
+                f"{f'(x{multiple:g})' if multiple != 1 else '':<6} {minutes:>2}:{seconds:02} {self.track_store.names[row]}"
+            )
+        for phase, seconds in self.metrics.report()["phase_seconds"].items():
+            print(f"{phase:<12} {seconds * 1000:9.1f} ms")
 
-        # populate self.track_info_dict with bpms
-        print("Populating self.track_info_dict with bpms...")
-        for track_id in self.track_info_dict.keys():
-            if self.get_track_bpm(track_id) is None:
-                del self.track_info_dict[track_id]
-                print(f"Deleted track_id {track_id} from self.track_info_dict")
-            else:
-                self.track_info_dict[track_id]["bpm"] = self.get_track_bpm(
-                    track_id
-                )
+        return sorted_tracks
+
+    def run_report(self) -> dict:
+        """
+        Phase timings, cache hits, pool sizes and Spotify requests of this run, see metrics.RunMetrics
+        """
+        report = self.metrics.report()
+        report["preferences"] = {
+            "intensity": self.intensity,
+            "session_length": self.session_length,
+            "genres": self.genres,
+        }
+        return report
+
+    def catalog_version(self) -> str:
+        """
+        Version of the genre playlists plans are made from, changing whenever one of their snapshots does
+        """
+        snapshot_ids = self.fetch_snapshot_ids(self.genre_playlist_ids())
+        return hashlib.md5(json.dumps(sorted(snapshot_ids.items())).encode()).hexdigest()
+
+    def report_phase(self, phase):
+        if self.on_phase is not None:
+            self.on_phase(phase)
 
+    def populate_track_info(self):
+        """
+        Populate self.track_store with the tracks of the preferred genres and their bpms;
+        bpms are resolved a batch at a time while later pages are still downloading
+        """
+        print("Getting songs from preferred genres and populating self.track_store with bpms...")
+        self.report_phase("fetch")
+        seen_track_ids = set()
+        track_ids = []
+        for track in self.metrics.timed_iter("ingestion", self.iter_genre_playlist_tracks()):
+            if track.id in seen_track_ids:
+                continue
+
+            seen_track_ids.add(track.id)
+            self.add_track_info(track)
+            track_ids.append(track.id)
+            if len(track_ids) == self.audio_features_batch_size:
+                self.add_track_bpms(track_ids)
+                track_ids = []
+
+        self.report_phase("tempo")
+        self.add_track_bpms(track_ids)
+
+        self.metrics.set("tracks_ingested", len(seen_track_ids))
+        self.metrics.set("tracks_with_tempo", len(self.track_store))
+
+        # only now is every track of the synced playlists in the tempo cache
+        self.snapshot_store.save(self.synced_snapshots)
+        self.synced_snapshots = {}
+
+    def plan_playlist(self) -> List[str]:
+        """
+        Return the uris of the tracks in self.track_store to play, sorted by ascending and descending bpm.
+        Tracks are also planned at half or double their bpm, see playlist_planner.tempo_multiples
+        """
         min_desired_bpm, max_desired_bpm = self.cardio_bpm_dict[self.intensity]
 
         resting_heartrate_bpm = 75
-        total_tracks_duration_ms = 0
-
-        tracks = [
-            track
-            for track in self.track_info_dict.values()
-            if resting_heartrate_bpm < track["bpm"] < max_desired_bpm
-        ]
 
-        milliseconds_per_minute = 60000
+        with self.metrics.phase("gap_filling"):
+            self.fill_bpm_gaps(resting_heartrate_bpm, min_desired_bpm)
 
-        print("Total num tracks retrieved: ", len(self.track_info_dict))
-        print("Total tracks time (min): ", sum(
-            [track["duration"] for track in self.track_info_dict.values()]
-        ) / milliseconds_per_minute
-        )
-        print("Total number of songs with required bpm: ", len(tracks))
-        print("Total tracks time (min): ", sum(
-            [track["duration"] for track in tracks]
-        ) / milliseconds_per_minute
+        # tracks with a bpm that fits at one of the multiples
+        rows = self.track_store.rows_in_bpm_range(
+            resting_heartrate_bpm / max(tempo_multiples),
+            max_desired_bpm / min(tempo_multiples)
         )
 
-        def track_bpm(track):
-            return track["bpm"]
-
-        tracks.sort(key=track_bpm)
+        milliseconds_per_minute = 60000
 
-        warmup_bpm_1 = resting_heartrate_bpm + \
-            (min_desired_bpm - resting_heartrate_bpm) / 3
-        warmup_bpm_2 = min_desired_bpm - \
-            (min_desired_bpm - resting_heartrate_bpm) / 3
+        print("Total num tracks retrieved: ", len(self.track_store))
+        print("Total tracks time (min): ", self.track_store.total_duration() / milliseconds_per_minute)
+        print("Total number of songs with required bpm: ", len(rows))
+        print("Total tracks time (min): ", self.track_store.total_duration(rows) / milliseconds_per_minute)
 
         # sort tracks by ascending and descending bpm
-        sorted_tracks = []
-
-        print("Adding warmup tracks to track list...")
-        for index, track in enumerate(tracks):
-            if (warmup_bpm_1 - 10) < track["bpm"] < (warmup_bpm_1 + 10):
-                track = tracks.pop(index)
-                # max_track_bpm = track["bpm"]
-                sorted_tracks.append(track["uri"])
-                total_tracks_duration_ms += track["duration"]
-                break
+        print("Planning warmup, cardio intensity and cooldown tracks...")
+        with self.metrics.phase("sequencing"):
+            plan = plan_session(
+                self.track_store.bpms[rows],
+                self.track_store.durations[rows],
+                min_desired_bpm,
+                max_desired_bpm,
+                self.session_length * milliseconds_per_minute,
+                resting_bpm=resting_heartrate_bpm,
+                max_bpm_step=self.max_bpm_step,
+                tolerance_ms=self.session_length_tolerance_ms,
+                seed=self.plan_variant or None,
+            )
+            sorted_tracks = self.track_store.uris_of(rows[plan.order])
+        self.tempo_multiples = {
+            self.track_store.uris[rows[position]]: multiple
+            for position, multiple in plan.multiples.items()
+            if multiple != 1
+        }
+        self.metrics.set("candidate_tracks", len(rows))
+        self.metrics.set("tempo_folded_tracks", len(self.tempo_multiples))
+        self.metrics.set("planned_tracks", len(sorted_tracks))
+        self.metrics.set("planned_minutes", plan.duration_ms / milliseconds_per_minute)
+        self.metrics.set("planned_shortfall_minutes", plan.shortfall_ms / milliseconds_per_minute)
+        planned_bpms = plan.planned_bpms(self.track_store.bpms[rows])
+        self.metrics.set("max_planned_bpm_step", float(np.abs(np.diff(planned_bpms)).max(initial=0)))
+        print(
+            f"Planned {len(plan.warmup)} warmup, {len(plan.hold)} cardio intensity and "
+            f"{len(plan.cooldown)} cooldown tracks ({plan.duration_ms / milliseconds_per_minute:.1f} min)"
+        )
+        if plan.shortfall_ms:
+            print(
+                f"The tracks of the preferred genres only fill {plan.duration_ms / milliseconds_per_minute:.1f} of "
+                f"{self.session_length} min in bpm steps of at most {self.max_bpm_step}; "
+                f"choose more genres for a full session"
+            )
 
-        for index, track in enumerate(tracks):
-            if (warmup_bpm_2 - 10) < track["bpm"] < (warmup_bpm_2 + 10):
-                track = tracks.pop(index)
-                # max_track_bpm = track["bpm"]
-                sorted_tracks.append(track["uri"])
-                total_tracks_duration_ms += track["duration"]
-                break
+        return sorted_tracks
 
-        print("Adding songs at desired cardio intensity to track list...")
-        while (
-            total_tracks_duration_ms < (
-                self.session_length - 2 * self.avg_song_length_min
-            ) * milliseconds_per_minute
+    def fill_bpm_gaps(self, low_bpm, high_bpm):
+        """
+        Wherever the bpms of the tracks in self.track_store, at any of tempo_multiples, leave a gap of more than
+        self.max_bpm_step on the way from low_bpm up to high_bpm, add the tracks of the tempo cache most like
+        the track below the gap until it is closed. Tracks are looked up in self.similarity_index,
+        locally, instead of asking Spotify for recommendations
+        """
+        rows = self.track_store.all_rows()
+        positions, effective_bpms, _ = fold_tempos(self.track_store.bpms[rows], low_bpm, high_bpm)
+        ascending = np.argsort(effective_bpms, kind="stable")
+        # the bpms from low_bpm up to high_bpm, and the rows of the tracks at them
+        ladder_bpms = np.concatenate([[low_bpm], effective_bpms[ascending], [high_bpm]])
+        ladder_rows = np.concatenate([[-1], rows[positions][ascending], [-1]])
+
+        filled_track_ids = []
+        for gap in np.flatnonzero(np.diff(ladder_bpms) > self.max_bpm_step).tolist():
+            bpm, next_bpm = float(ladder_bpms[gap]), float(ladder_bpms[gap + 1])
+            # the first gap has no track below it, so its tracks are like the one above it
+            row = int(ladder_rows[gap] if ladder_rows[gap] != -1 else ladder_rows[gap + 1])
+            track_id = self.track_store.ids[row] if row != -1 else None
+            while next_bpm - bpm > self.max_bpm_step:
+                track_id = self.add_similar_track(track_id, bpm, bpm + self.max_bpm_step)
+                if track_id is None:
+                    break
+
+                bpm = self.track_store.bpm(track_id)
+                filled_track_ids.append(track_id)
+
+        self.metrics.set("gap_filled_tracks", len(filled_track_ids))
+        if filled_track_ids:
+            print(f"Filled bpm gaps with {len(filled_track_ids)} similar tracks from the tempo cache")
+
+    def add_similar_track(self, track_id, low_bpm, high_bpm) -> Optional[str]:
+        """
+        Add the track of the tempo cache most like track_id with a bpm strictly between low_bpm and high_bpm
+        to self.track_store, and return its id; None when there is none
+        """
+        for similar_track_id in self.similarity_index.nearest_to_track(
+            track_id, k=5, bpm_low=low_bpm, bpm_high=high_bpm, exclude=self.track_store
         ):
-            # num_songs_to_max_desired_bpm = 2
-            # while max_desired_bpm - max_track_bpm / num_songs_to_max_desired_bpm > 20:
-            #     num_songs_to_max_desired_bpm += 1
-
-            # bpm_delta = max_desired_bpm - max_track_bpm / num_songs_to_max_desired_bpm
-
-            for index, track in enumerate(tracks):
-                # if (bpm_delta - 10) < track["bpm"] < (bpm_delta + 10):
-                if (max_desired_bpm - 20) < track["bpm"] < max_desired_bpm:
-                    track = tracks.pop(index)
-                    # max_track_bpm = track["bpm"]
-                    sorted_tracks.append(track["uri"])
-                    total_tracks_duration_ms += track["duration"]
-
-            break
-
-        print("Adding cooldown tracks to track list...")
-        for index, track in enumerate(tracks):
-            if (warmup_bpm_2 - 10) < track["bpm"] < (warmup_bpm_2 + 10):
-                track = tracks.pop(index)
-                sorted_tracks.append(track["uri"])
-                total_tracks_duration_ms += track["duration"]
-                break
+            self.tempo_cache.load([similar_track_id])
+            track = self.tempo_cache.tracks.get(similar_track_id)
+            bpm = self.tempo_cache.tracks.bpm(similar_track_id) if track is not None else None
+            # the index may be ahead of this session's tempo cache, or hold a bpm since replaced
+            if track is None or not track.uri or bpm is None or not low_bpm < bpm < high_bpm:
+                continue
 
-        for index, track in enumerate(tracks):
-            if (warmup_bpm_1 - 10) < track["bpm"] < (warmup_bpm_1 + 10):
-                track = tracks.pop(index)
-                sorted_tracks.append(track["uri"])
-                total_tracks_duration_ms += track["duration"]
-                break
+            self.add_track_info(track)
+            self.track_store.set_bpm(similar_track_id, bpm)
+            return similar_track_id
 
-        # create playlist
-        playlist_id = self.create_playlist()
+        return None
 
-        # request_data = json.dumps({"uris": sorted_tracks})
+    def publish_playlist(self, sorted_tracks) -> Optional[str]:
+        """
+        Create a playlist, or with self.replace_playlist reuse the one generated before for the same
+        preferences, add sorted_tracks to it and return its playlist_id
+        """
+        from spotipy import SpotifyException
+
+        publisher = PlaylistPublisher(self.spotify_client)
+
+        playlist_id = None
+        if self.replace_playlist:
+            playlist = self.playlist_store.find(self.user_id, self.preset)
+            if playlist is not None:
+                print(f"Replacing the tracks of playlist {playlist.id}...")
+                try:
+                    with self.metrics.phase("publish"):
+                        publisher.publish(playlist.id, sorted_tracks, replace=True)
+                    playlist_id = playlist.id
+                    self.playlist_name = playlist.name
+                except SpotifyException as e:
+                    # the user deleted the playlist
+                    if e.http_status != 404:
+                        raise
 
-        # add tracks to playlist
-        print("Adding tracks to playlist...")
-        if playlist_id is not None:
+        if playlist_id is None:
+            # create playlist
+            with self.metrics.phase("create"):
+                playlist_id = self.create_playlist()
 
-            self.spotify_client.playlist_add_items(
-                playlist_id,
-                sorted_tracks
-            )
+            # request_data = json.dumps({"uris": sorted_tracks})
+
+            # add tracks to playlist
+            print("Adding tracks to playlist...")
+            with self.metrics.phase("publish"):
+                publisher.publish(playlist_id, sorted_tracks)
+
+        if playlist_id is not None:
             # add_tracks_url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
 
             # add_tracks_response = requests.post(
@@ -725,11 +1139,232 @@ class MyCardioBeats:
             #     raise ResponseException(add_tracks_response.status_code)
 
             print("All tracks have been successfully added to playlist!")
+
+            with self.metrics.phase("persist"):
+                self.save_playlist(playlist_id, sorted_tracks)
             # add_tracks_response_json = add_tracks_response.json()
             # return add_tracks_response_json
 
+        return playlist_id
+
+    def planned_tracks(self, sorted_tracks) -> CachedPlan:
+        """
+        The tracks of self.track_store with uris sorted_tracks, in order, with their bpms
+        """
+        rows = self.track_store.rows_of_uris(sorted_tracks)
+        return CachedPlan(
+            tracks=[self.track_store.get(self.track_store.ids[row]) for row in rows.tolist()],
+            bpms=self.track_store.bpms[rows].tolist(),
+        )
+
+    def save_playlist(self, playlist_id, sorted_tracks):
+        """
+        Save the published playlist and its tracks in order to self.playlist_store
+        """
+        planned_tracks = self.planned_tracks(sorted_tracks)
+        self.playlist_store.save(
+            playlist_id,
+            " ".join(self.playlist_name.split()),
+            planned_tracks.tracks,
+            planned_tracks.bpms,
+            user_id=self.user_id,
+            preset=self.preset,
+        )
+
+
+def validate_preferences(intensity, session_length, genres) -> Tuple[str, int, list]:
+    """
+    Check preferences given without prompting and return them as intensity, session length in minutes
+    and genre names; raises ValueError for unsupported preferences or no genre
+    """
+    if intensity not in cardio_bpm_dict:
+        raise ValueError(f"Unsupported exercise intensity: {intensity}")
+
+    if int(session_length) < 5:
+        raise ValueError("Session length must be at least 5 minutes")
+
+    if len(genres) == 0:
+        raise ValueError("At least one genre is required")
+
+    unknown_genres = [
+        genre
+        for genre in genres
+        if genre not in genre_dict and genre not in cardio_playlists_ids
+    ]
+    if len(unknown_genres) > 0:
+        raise ValueError(f"Unknown genres: {unknown_genres}")
+
+    return (intensity, int(session_length), [genre_dict.get(genre, genre) for genre in genres])
+
+
+@contextmanager
+def request_priority(priority):
+    """
+    Send the Spotify requests made in the with block at priority, see request_scheduler
+    """
+    from http_session import get_spotify_session
+
+    with get_spotify_session().scheduler.priority(priority):
+        yield
+
+
+def load_user_token(interactive) -> Optional[Token]:
+    """
+    Token of the user for a token manager that has none stored yet: the static spotify_access_token,
+    else the token cached by spotipy's OAuth flow, else, if interactive, one the user authorizes the app for
+    """
+    if spotify_access_token is not None:
+        return Token(spotify_access_token, static_token_lifetime_seconds, None)
+
+    token = cached_spotipy_token()
+    if token is None and interactive:
+        token = authorize_interactively()
+    return token
+
+
+def build_token_manager(interactive=True) -> TokenManager:
+    """
+    Token manager for the user, see load_user_token
+    """
+    return TokenManager(load_token=lambda: load_user_token(interactive))
+
+
+def build_spotify_client(open_browser=True, token_manager: Optional[TokenManager] = None) -> "spotipy.Spotify":
+    """
+    Spotify client for spotify_api_url authorized for the user in secrets, sending its requests through the
+    shared session with the tokens of token_manager, by default build_token_manager(). The static
+    spotify_access_token is used instead of OAuth when it is set.
+    With open_browser the user is asked to authorize the app on the first request if no token is stored;
+    without it a token stored by an earlier interactive run must exist, else SpotifyAuthorizationError
+    is raised right away rather than prompting in the middle of a batch or a job
+    """
+    import spotipy
+    from http_session import get_spotify_session
+
+    session = get_spotify_session()
+    if spotify_access_token is not None:
+        spotify_client = spotipy.Spotify(auth=spotify_access_token, requests_session=session)
+    else:
+        if token_manager is None:
+            token_manager = build_token_manager(interactive=open_browser)
+        if not open_browser:
+            # load the token now, raising SpotifyAuthorizationError without one, rather than on the first request
+            token_manager.get_access_token()
+        spotify_client = spotipy.Spotify(auth_manager=TokenManagerAuth(token_manager), requests_session=session)
+
+    spotify_client.prefix = spotify_api_url
+    return spotify_client
+
+
+def generate_playlists(
+    preferences_path,
+    run_reports: Optional[list] = None,
+    audio_directory=None,
+) -> List[Optional[str]]:
+    """
+    Generate a playlist for every line of preferences_path, a JSON object with intensity, session_length
+    and genres, e.g. {"intensity": "c", "session_length": 45, "genres": ["pop", "dance"]},
+    and optionally "replace": true to replace the tracks of the playlist generated before for the same preferences.
+    All playlists share one Spotify client, tempo cache and set of fetched genre playlists.
+    Returns the playlist id of each line, None where generating it failed;
+    the run report of every playlist generated is appended to run_reports.
+    Tempos Spotify has none for are detected from the clips in audio_directory, see bpm_detection
+    """
+    with open(preferences_path) as preferences_file:
+        all_preferences = [
+            json.loads(line)
+            for line in preferences_file
+            if line.strip() != ""
+        ]
+
+    spotify_client = build_spotify_client(open_browser=False)
+    tempo_cache = TempoCache()
+    playlist_tracks_cache = {}
+
+    playlist_ids = []
+    for number, preferences in enumerate(all_preferences, start=1):
+        print(f"Generating playlist {number} of {len(all_preferences)}...")
+        try:
+            mcb = MyCardioBeats(
+                intensity=preferences["intensity"],
+                session_length=preferences["session_length"],
+                genres=preferences["genres"],
+                spotify_client=spotify_client,
+                tempo_cache=tempo_cache,
+                playlist_tracks_cache=playlist_tracks_cache,
+                replace_playlist=preferences.get("replace", False),
+                audio_directory=audio_directory,
+            )
+            playlist_ids.append(mcb.add_songs_to_playlist())
+            if run_reports is not None:
+                run_reports.append(mcb.run_report())
+        except Exception as e:
+            print(f"Failed to generate playlist {number}: {e!r}")
+            playlist_ids.append(None)
+
+    return playlist_ids
+
 
 if __name__ == '__main__':
-    mcb = MyCardioBeats()
-    mcb.add_songs_to_playlist()
+    parser = argparse.ArgumentParser(description="Create a Spotify playlist for a cardio session")
+    parser.add_argument("--intensity", choices=["fat_burn", "f", "cardio", "c", "peak", "p"])
+    parser.add_argument("--session-length", type=int, help="session length in minutes")
+    parser.add_argument("--genres", nargs="+", help="e.g. --genres pop dance")
+    parser.add_argument(
+        "--batch",
+        metavar="PREFERENCES_FILE",
+        help="generate a playlist for every JSON line of PREFERENCES_FILE without prompting"
+    )
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="replace the tracks of the playlist generated before for the same preferences instead of creating one"
+    )
+    parser.add_argument(
+        "--audio-directory",
+        help="detect the tempos Spotify has none for from the clips in this directory, named <track id>.wav"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the playlist planned from the locally cached tracks and tempos without contacting Spotify"
+    )
+    parser.add_argument("--metrics-json", metavar="PATH", help="write the run report of every playlist as JSON")
+    parser.add_argument("--metrics-prometheus", metavar="PATH", help="write the metrics in the Prometheus text format")
+    parser.add_argument("--profile", metavar="PATH", help="write cProfile stats of the run")
+    parser.add_argument("--trace-memory", action="store_true", help="add the tracemalloc peak to the run report")
+    args = parser.parse_args()
+
+    run_reports = []
+    with profiled(args.profile, args.trace_memory) as profile_results:
+        if args.batch is not None:
+            generate_playlists(args.batch, run_reports, audio_directory=args.audio_directory)
+        elif args.dry_run:
+            mcb = MyCardioBeats(
+                intensity=args.intensity,
+                session_length=args.session_length,
+                genres=args.genres,
+            )
+            mcb.plan_from_local_cache()
+            run_reports.append(mcb.run_report())
+        else:
+            mcb = MyCardioBeats(
+                intensity=args.intensity,
+                session_length=args.session_length,
+                genres=args.genres,
+                replace_playlist=args.replace,
+                audio_directory=args.audio_directory,
+            )
+            mcb.add_songs_to_playlist()
+            run_reports.append(mcb.run_report())
+
+    if args.metrics_json is not None:
+        for run_report in run_reports:
+            run_report["values"].update(profile_results)
+        with open(args.metrics_json, "w") as metrics_file:
+            json.dump(run_reports if args.batch is not None else run_reports[0], metrics_file, indent=2)
+
+    if args.metrics_prometheus is not None:
+        with open(args.metrics_prometheus, "w") as metrics_file:
+            metrics_file.write(get_metrics().to_prometheus())
     # print(mcb.generate_random_string(10))
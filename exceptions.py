@@ -4,4 +4,16 @@ class ResponseException(Exception):
         self.status_code = status_code
 
     def __str__(self):
-        return self.message + f"Response gave status code {self.status_code}"
\ No newline at end of file
+        return self.message + f"Response gave status code {self.status_code}"
+
+
+class RateLimitException(ResponseException):
+    def __init__(self, retry_after, message=""):
+        super().__init__(429, message)
+        self.retry_after = retry_after
+
+
+class SpotifyAuthorizationError(Exception):
+    """
+    No Spotify token is available without asking the user to authorize the app
+    """
@@ -0,0 +1,69 @@
+import json
+import random
+import string
+
+from cardio_playlist import cardio_playlists_ids
+
+id_characters = string.ascii_letters + string.digits
+
+
+def generate_catalog(track_count=5000, playlist_size=150, seed=0) -> dict:
+    """
+    Deterministic synthetic catalog of track_count tracks with audio features, every cardio playlist holding
+    playlist_size of them, plus top tracks and artists for the user. About 3% of the tracks have no tempo,
+    like tracks Spotify has no analysis for
+    """
+    rng = random.Random(seed)
+
+    tracks = {}
+    while len(tracks) < track_count:
+        track_id = "".join(rng.choices(id_characters, k=22))
+        has_tempo = rng.random() > 0.03
+        tracks[track_id] = {
+            "id": track_id,
+            "uri": f"spotify:track:{track_id}",
+            "name": f"Track {len(tracks) + 1}",
+            "duration_ms": rng.randint(120000, 330000),
+            "tempo": round(min(210.0, max(55.0, rng.gauss(122, 28))), 3) if has_tempo else None,
+            "energy": round(rng.random(), 3),
+            "danceability": round(rng.random(), 3),
+            "valence": round(rng.random(), 3),
+            "acousticness": round(rng.random(), 3),
+            "loudness": round(rng.uniform(-20, 0), 3),
+        }
+
+    track_ids = list(tracks)
+    playlists = {
+        playlist_id: {
+            "name": genre.title(),
+            "snapshot_id": "".join(rng.choices(id_characters, k=32)),
+            "track_ids": rng.sample(track_ids, min(playlist_size, len(track_ids))),
+        }
+        for genre, playlist_id in cardio_playlists_ids.items()
+    }
+
+    artists = [
+        {
+            "id": "".join(rng.choices(id_characters, k=22)),
+            "name": f"Artist {number}",
+            "genres": rng.sample(list(cardio_playlists_ids), 2),
+        }
+        for number in range(1, 51)
+    ]
+
+    return {
+        "tracks": tracks,
+        "playlists": playlists,
+        "top_track_ids": rng.sample(track_ids, min(50, len(track_ids))),
+        "top_artists": artists,
+    }
+
+
+def load_catalog(path) -> dict:
+    with open(path) as catalog_file:
+        return json.load(catalog_file)
+
+
+def save_catalog(catalog, path):
+    with open(path, "w") as catalog_file:
+        json.dump(catalog, catalog_file)
@@ -0,0 +1,49 @@
+import spotipy
+import threading
+
+from fake_spotify.server import FakeSpotify
+from request_scheduler import endpoint_name
+from urllib.parse import urlencode, urlparse
+
+fake_host = "fake.spotify"
+
+
+class FakeSpotifyClient(spotipy.Spotify):
+    """
+    spotipy client answering every call in-process from a FakeSpotify, without HTTP or authorization.
+    self.calls counts the calls made per method and endpoint
+    """
+
+    def __init__(self, fake_spotify: FakeSpotify):
+        super().__init__(auth="offline", requests_session=False)
+        self.prefix = f"http://{fake_host}/v1/"
+        self.fake_spotify = fake_spotify
+        self.calls = {}
+        self.calls_lock = threading.Lock()
+
+    def _internal_call(self, method, url, payload, params):
+        if not url.startswith("http"):
+            url = self.prefix + url
+
+        query = urlencode({
+            name: value
+            for name, value in params.items()
+            if value is not None
+        })
+        parsed_url = urlparse(url)
+        path = parsed_url.path + "?" + "&".join(part for part in (parsed_url.query, query) if part)
+
+        endpoint = f"{method} {endpoint_name(url)}"
+        with self.calls_lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+        status, headers, body = self.fake_spotify.handle(method, path, payload or {}, {"Host": fake_host})
+        if status >= 400:
+            raise spotipy.SpotifyException(
+                status,
+                -1,
+                f"{url}:\n {body['error']['message']}",
+                headers=headers
+            )
+
+        return body
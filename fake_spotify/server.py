@@ -0,0 +1,406 @@
+import argparse
+import json
+import random
+import re
+import requests
+import threading
+import time
+
+from fake_spotify.catalog import generate_catalog, load_catalog, save_catalog
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from request_scheduler import endpoint_name
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+# most items Spotify accepts when adding tracks to a playlist
+max_playlist_items_per_request = 100
+
+
+class FakeSpotify:
+    """
+    Stand-in for the Spotify Web API and accounts endpoints used by cardio_playlist, serving a catalog from
+    fake_spotify.catalog. Every request waits latency_ms (plus up to latency_jitter_ms) and is answered with a
+    429 with probability rate_limit_rate or a 503 with probability error_rate.
+    Recorded responses are replayed before the catalog is consulted; with upstream_url set, requests that have
+    no recorded response are forwarded there and recorded to record_path instead
+    """
+
+    def __init__(
+        self,
+        catalog,
+        latency_ms=0,
+        latency_jitter_ms=0,
+        error_rate=0.0,
+        rate_limit_rate=0.0,
+        retry_after=1,
+        seed=0,
+        recorded_responses=None,
+        upstream_url=None,
+        record_path=None,
+    ):
+        self.catalog = catalog
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        # "METHOD path?query" -> {"status": ..., "body": ...}
+        self.recorded_responses = recorded_responses if recorded_responses is not None else {}
+        self.upstream_url = upstream_url
+        self.record_path = record_path
+        self.user_playlists = {}
+        self.lock = threading.Lock()
+        # endpoint name -> {"requests": ..., "bytes": ...}
+        self.stats = {}
+
+        self.routes = [
+            ("GET", r"/v1/playlists/(?P<playlist_id>[^/]+)/(?:tracks|items)", self.get_playlist_tracks),
+            ("POST", r"/v1/playlists/(?P<playlist_id>[^/]+)/(?:tracks|items)", self.add_playlist_tracks),
+            ("PUT", r"/v1/playlists/(?P<playlist_id>[^/]+)/(?:tracks|items)", self.replace_playlist_tracks),
+            ("GET", r"/v1/playlists/(?P<playlist_id>[^/]+)", self.get_playlist),
+            ("GET", r"/v1/audio-features/?", self.get_audio_features),
+            ("GET", r"/v1/audio-features/(?P<track_id>[^/]+)", self.get_track_audio_features),
+            ("GET", r"/v1/audio-analysis/(?P<track_id>[^/]+)", self.get_audio_analysis),
+            ("GET", r"/v1/me/top/tracks", self.get_top_tracks),
+            ("GET", r"/v1/(me|users/[^/]+)/top/artists", self.get_top_artists),
+            ("GET", r"/v1/recommendations", self.get_recommendations),
+            ("POST", r"/v1/users/(?P<user_id>[^/]+)/playlists", self.create_playlist),
+            ("GET", r"/v1/me", self.get_current_user),
+            ("POST", r"/api/token", self.get_token),
+        ]
+
+    def handle(self, method, url, body, headers) -> Tuple[int, dict, Optional[dict]]:
+        """
+        Return the status, headers and JSON body answering a request
+        """
+        parsed_url = urlparse(url)
+        if parsed_url.path == "/_stats":
+            with self.lock:
+                return 200, {}, dict(self.stats)
+
+        delay_ms = self.latency_ms + self.rng.uniform(0, self.latency_jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+        with self.lock:
+            injected = self.rng.random()
+        if injected < self.rate_limit_rate:
+            return 429, {"Retry-After": str(self.retry_after)}, {"error": {"status": 429, "message": "API rate limit exceeded"}}
+        if injected < self.rate_limit_rate + self.error_rate:
+            return 503, {}, {"error": {"status": 503, "message": "Service unavailable"}}
+
+        key = f"{method} {url}"
+        if key in self.recorded_responses:
+            recorded_response = self.recorded_responses[key]
+            return recorded_response["status"], {}, recorded_response["body"]
+
+        if self.upstream_url is not None:
+            return self.forward(method, url, body, headers)
+
+        query = {name: values[0] for name, values in parse_qs(parsed_url.query).items()}
+        for route_method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, parsed_url.path)
+            if route_method == method and match is not None:
+                return handler(query=query, body=body, url=f"http://{headers.get('Host', '')}{parsed_url.path}", **match.groupdict())
+
+        return 404, {}, {"error": {"status": 404, "message": "Service not found"}}
+
+    def forward(self, method, url, body, headers) -> Tuple[int, dict, Optional[dict]]:
+        response = requests.request(
+            method,
+            self.upstream_url.rstrip("/") + url,
+            json=body or None,
+            headers={
+                name: value
+                for name, value in headers.items()
+                if name in ("Authorization", "Content-Type")
+            },
+        )
+        response_body = response.json() if response.content else None
+
+        with self.lock:
+            self.recorded_responses[f"{method} {url}"] = {"status": response.status_code, "body": response_body}
+            if self.record_path is not None:
+                with open(self.record_path, "w") as record_file:
+                    json.dump(self.recorded_responses, record_file)
+
+        retry_headers = {"Retry-After": response.headers["Retry-After"]} if "Retry-After" in response.headers else {}
+        return response.status_code, retry_headers, response_body
+
+    def record_stats(self, url, body_size):
+        with self.lock:
+            stats = self.stats.setdefault(endpoint_name(url), {"requests": 0, "bytes": 0})
+            stats["requests"] += 1
+            stats["bytes"] += body_size
+
+    def track_object(self, track_id) -> dict:
+        track = self.catalog["tracks"][track_id]
+        return {
+            "id": track_id,
+            "uri": track["uri"],
+            "name": track["name"],
+            "duration_ms": track["duration_ms"],
+            "type": "track",
+        }
+
+    def page(self, items, query, url) -> dict:
+        offset = int(query.get("offset", 0))
+        limit = int(query.get("limit", 20))
+        next_url = None
+        if offset + limit < len(items):
+            next_url = f"{url}?" + urlencode({**query, "offset": offset + limit, "limit": limit})
+
+        return {
+            "items": items[offset:offset + limit],
+            "offset": offset,
+            "limit": limit,
+            "total": len(items),
+            "next": next_url,
+        }
+
+    def playlist_track_ids(self, playlist_id) -> Optional[list]:
+        if playlist_id in self.user_playlists:
+            return self.user_playlists[playlist_id]["track_ids"]
+        if playlist_id in self.catalog["playlists"]:
+            return self.catalog["playlists"][playlist_id]["track_ids"]
+
+        return None
+
+    def get_playlist_tracks(self, playlist_id, query, body, url):
+        track_ids = self.playlist_track_ids(playlist_id)
+        if track_ids is None:
+            return 404, {}, {"error": {"status": 404, "message": "Not found."}}
+
+        page = self.page(track_ids, query, url)
+        page["items"] = [{"track": self.track_object(track_id)} for track_id in page["items"]]
+        return 200, {}, page
+
+    def get_playlist(self, playlist_id, query, body, url):
+        playlist = self.user_playlists.get(playlist_id) or self.catalog["playlists"].get(playlist_id)
+        if playlist is None:
+            return 404, {}, {"error": {"status": 404, "message": "Not found."}}
+
+        return 200, {}, {
+            "id": playlist_id,
+            "name": playlist["name"],
+            "snapshot_id": playlist["snapshot_id"],
+            "tracks": {"total": len(playlist["track_ids"])},
+        }
+
+    def add_playlist_tracks(self, playlist_id, query, body, url):
+        if playlist_id not in self.user_playlists:
+            return 404, {}, {"error": {"status": 404, "message": "Not found."}}
+
+        uris = body.get("uris", []) if isinstance(body, dict) else body
+        if len(uris) > max_playlist_items_per_request:
+            return 400, {}, {"error": {"status": 400, "message": "You can add a maximum of 100 tracks per request."}}
+
+        playlist = self.user_playlists[playlist_id]
+        position = query.get("position", body.get("position") if isinstance(body, dict) else None)
+        position = len(playlist["track_ids"]) if position is None else int(position)
+        if position > len(playlist["track_ids"]):
+            return 400, {}, {"error": {"status": 400, "message": "Index out of bounds."}}
+
+        with self.lock:
+            playlist["track_ids"][position:position] = [uri.split(":")[-1] for uri in uris]
+            playlist["snapshot_id"] = f"snapshot-{self.rng.random()}"
+        return 201, {}, {"snapshot_id": playlist["snapshot_id"]}
+
+    def replace_playlist_tracks(self, playlist_id, query, body, url):
+        if playlist_id not in self.user_playlists:
+            return 404, {}, {"error": {"status": 404, "message": "Not found."}}
+
+        playlist = self.user_playlists[playlist_id]
+        with self.lock:
+            if "range_start" in body:
+                track_ids = playlist["track_ids"]
+                range_start = body["range_start"]
+                range_length = body.get("range_length", 1)
+                insert_before = body["insert_before"]
+                moved_track_ids = track_ids[range_start:range_start + range_length]
+                del track_ids[range_start:range_start + range_length]
+                if insert_before > range_start:
+                    insert_before -= range_length
+                track_ids[insert_before:insert_before] = moved_track_ids
+            else:
+                uris = body.get("uris", [])
+                if len(uris) > max_playlist_items_per_request:
+                    return 400, {}, {"error": {"status": 400, "message": "You can set a maximum of 100 tracks."}}
+                playlist["track_ids"] = [uri.split(":")[-1] for uri in uris]
+
+            playlist["snapshot_id"] = f"snapshot-{self.rng.random()}"
+        return 200, {}, {"snapshot_id": playlist["snapshot_id"]}
+
+    def audio_features_object(self, track_id) -> Optional[dict]:
+        track = self.catalog["tracks"].get(track_id)
+        if track is None or track["tempo"] is None:
+            return None
+
+        return {
+            "id": track_id,
+            "uri": track["uri"],
+            "type": "audio_features",
+            "duration_ms": track["duration_ms"],
+            **{
+                feature: track[feature]
+                for feature in ("tempo", "energy", "danceability", "valence", "acousticness", "loudness")
+            },
+        }
+
+    def get_audio_features(self, query, body, url):
+        track_ids = query.get("ids", "").split(",")
+        if len(track_ids) > 100:
+            return 400, {}, {"error": {"status": 400, "message": "Too many ids requested"}}
+
+        return 200, {}, {"audio_features": [self.audio_features_object(track_id) for track_id in track_ids]}
+
+    def get_track_audio_features(self, track_id, query, body, url):
+        audio_features = self.audio_features_object(track_id)
+        if audio_features is None:
+            return 404, {}, {"error": {"status": 404, "message": "analysis not found"}}
+
+        return 200, {}, audio_features
+
+    def get_audio_analysis(self, track_id, query, body, url):
+        track = self.catalog["tracks"].get(track_id)
+        if track is None or track["tempo"] is None:
+            return 404, {}, {"error": {"status": 404, "message": "analysis not found"}}
+
+        # as large as the real analysis: a beat and a segment per beat
+        beat_seconds = 60 / track["tempo"]
+        beats = [
+            {"start": round(number * beat_seconds, 5), "duration": round(beat_seconds, 5), "confidence": 0.5}
+            for number in range(int(track["duration_ms"] / 1000 / beat_seconds))
+        ]
+        return 200, {}, {
+            "track": {"duration": track["duration_ms"] / 1000, "tempo": track["tempo"], "tempo_confidence": 0.8},
+            "beats": beats,
+            "segments": [{**beat, "pitches": [0.5] * 12, "timbre": [0.0] * 12} for beat in beats],
+        }
+
+    def get_top_tracks(self, query, body, url):
+        page = self.page(self.catalog["top_track_ids"], query, url)
+        page["items"] = [self.track_object(track_id) for track_id in page["items"]]
+        return 200, {}, page
+
+    def get_top_artists(self, query, body, url):
+        return 200, {}, self.page(self.catalog["top_artists"], query, url)
+
+    def get_recommendations(self, query, body, url):
+        limit = int(query.get("limit", 20))
+        with self.lock:
+            track_ids = self.rng.sample(list(self.catalog["tracks"]), min(limit, len(self.catalog["tracks"])))
+
+        return 200, {}, {"tracks": [self.track_object(track_id) for track_id in track_ids]}
+
+    def create_playlist(self, user_id, query, body, url):
+        with self.lock:
+            playlist_id = f"fakeplaylist{len(self.user_playlists) + 1:010d}"
+            self.user_playlists[playlist_id] = {
+                "name": body.get("name", ""),
+                "snapshot_id": "snapshot-0",
+                "track_ids": [],
+                "owner": user_id,
+            }
+
+        return 201, {}, {"id": playlist_id, "name": body.get("name", ""), "owner": {"id": user_id}}
+
+    def get_current_user(self, query, body, url):
+        return 200, {}, {"id": "offline_user", "display_name": "Offline User"}
+
+    def get_token(self, query, body, url):
+        return 200, {}, {"access_token": "offline", "token_type": "Bearer", "expires_in": 3600}
+
+
+def make_handler(fake_spotify):
+
+    class FakeSpotifyHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def respond(self):
+            content_length = int(self.headers.get("Content-Length", 0))
+            raw_body = self.rfile.read(content_length) if content_length else b""
+            try:
+                body = json.loads(raw_body) if raw_body else {}
+            except ValueError:
+                # form encoded token requests
+                body = {name: values[0] for name, values in parse_qs(raw_body.decode()).items()}
+
+            status, headers, response_body = fake_spotify.handle(self.command, self.path, body, self.headers)
+            encoded_body = json.dumps(response_body).encode() if response_body is not None else b""
+            if not self.path.startswith("/_stats"):
+                fake_spotify.record_stats(self.path, len(encoded_body))
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(encoded_body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(encoded_body)
+
+        do_GET = do_POST = do_PUT = do_DELETE = respond
+
+    return FakeSpotifyHandler
+
+
+def start_server(fake_spotify, host="127.0.0.1", port=0) -> ThreadingHTTPServer:
+    """
+    Serve fake_spotify on a background thread; port 0 picks a free port, see server.server_port
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(fake_spotify))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline stand-in for the Spotify Web API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--catalog", help="catalog JSON file; a synthetic catalog is generated when not given")
+    parser.add_argument("--tracks", type=int, default=5000, help="tracks in the synthetic catalog")
+    parser.add_argument("--playlist-size", type=int, default=150, help="tracks per synthetic cardio playlist")
+    parser.add_argument("--save-catalog", help="write the catalog in use to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds of injected 429s")
+    parser.add_argument("--replay", help="JSON file of recorded responses to serve")
+    parser.add_argument("--upstream", help="forward requests without a recorded response here, e.g. https://api.spotify.com")
+    parser.add_argument("--record", help="write recorded responses of forwarded requests to this file")
+    args = parser.parse_args()
+
+    if args.catalog is not None:
+        catalog = load_catalog(args.catalog)
+    else:
+        catalog = generate_catalog(args.tracks, args.playlist_size, args.seed)
+    if args.save_catalog is not None:
+        save_catalog(catalog, args.save_catalog)
+
+    recorded_responses = None
+    if args.replay is not None:
+        with open(args.replay) as replay_file:
+            recorded_responses = json.load(replay_file)
+
+    fake_spotify = FakeSpotify(
+        catalog,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        recorded_responses=recorded_responses,
+        upstream_url=args.upstream,
+        record_path=args.record,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake_spotify))
+    print(f"Serving a fake Spotify API with {len(catalog['tracks'])} tracks on http://{args.host}:{server.server_port}/v1/")
+    server.serve_forever()
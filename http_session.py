@@ -0,0 +1,133 @@
+import random
+import requests
+import threading
+import time
+
+from exceptions import RateLimitException, ResponseException
+from metrics import get_metrics
+from request_scheduler import RequestScheduler, default_endpoint_rates, endpoint_name
+from requests.adapters import HTTPAdapter
+from typing import Optional
+
+
+class SpotifySession(requests.Session):
+    """
+    requests.Session keeping a pool of keep-alive connections per host.
+    Rate limited (429) and unavailable (5xx) responses are retried with exponential backoff and full jitter,
+    waiting at least as long as the Retry-After header asks. Only 429s are retried for POST, PUT and DELETE
+    requests, which Spotify has not processed when it answers with one.
+    Every attempt waits for its turn with self.scheduler first
+    """
+
+    retry_statuses = {429, 500, 502, 503, 504}
+    idempotent_methods = {"GET", "HEAD", "OPTIONS"}
+
+    def __init__(
+        self,
+        pool_size=10,
+        max_retries=5,
+        backoff_seconds=0.5,
+        max_backoff_seconds=30,
+        timeout=10,
+        scheduler: Optional[RequestScheduler] = None,
+    ):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.timeout = timeout
+        # paces every attempt, including retries
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler(
+            endpoint_rates=default_endpoint_rates
+        )
+
+    def request(self, method, url, *args, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+
+        endpoint = endpoint_name(url)
+        metrics = get_metrics()
+
+        attempt = 0
+        while True:
+            response = None
+            self.scheduler.acquire(endpoint)
+            start = time.perf_counter()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+                self.scheduler.record_response(response.status_code, retry_after_seconds(response))
+                self.record_metrics(metrics, method, endpoint, start, response)
+            except (requests.ConnectionError, requests.Timeout):
+                self.record_metrics(metrics, method, endpoint, start, None)
+                if attempt == self.max_retries or method.upper() not in self.idempotent_methods:
+                    raise
+            else:
+                if not self.should_retry(method, response) or attempt == self.max_retries:
+                    return response
+
+            time.sleep(self.retry_delay(attempt, response))
+            attempt += 1
+
+    @staticmethod
+    def record_metrics(metrics, method, endpoint, start, response: Optional[requests.Response]):
+        """
+        Count an attempt, the seconds it took and the bytes it sent and received, per endpoint
+        """
+        status = "error" if response is None else response.status_code
+        metrics.increment("spotify_requests_total", method=method.upper(), endpoint=endpoint, status=status)
+        metrics.increment("spotify_request_seconds_total", time.perf_counter() - start, endpoint=endpoint)
+        if response is not None:
+            metrics.increment("spotify_response_bytes_total", len(response.content), endpoint=endpoint)
+            metrics.increment("spotify_request_bytes_total", len(response.request.body or b""), endpoint=endpoint)
+
+    def should_retry(self, method, response) -> bool:
+        if response.status_code == 429:
+            return True
+
+        return response.status_code in self.retry_statuses and method.upper() in self.idempotent_methods
+
+    def retry_delay(self, attempt, response: Optional[requests.Response]) -> float:
+        backoff = random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+        if response is None:
+            return backoff
+
+        return max(retry_after_seconds(response), backoff)
+
+
+def retry_after_seconds(response: requests.Response) -> float:
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except ValueError:
+        return 0
+
+
+def check_response(response: requests.Response, message="") -> requests.Response:
+    """
+    Raise RateLimitException or ResponseException for unsuccessful responses
+    """
+    if response.status_code == 429:
+        raise RateLimitException(retry_after_seconds(response), message)
+
+    if response.status_code >= 400:
+        raise ResponseException(response.status_code, message)
+
+    return response
+
+
+spotify_session = None
+spotify_session_lock = threading.Lock()
+
+
+def get_spotify_session(**session_options) -> SpotifySession:
+    """
+    Return the session shared by every outbound call, creating it with session_options on first use
+    """
+    global spotify_session
+
+    with spotify_session_lock:
+        if spotify_session is None:
+            spotify_session = SpotifySession(**session_options)
+
+        return spotify_session
@@ -0,0 +1,228 @@
+import cProfile
+import threading
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# (metric name, sorted (label, value) pairs)
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def metric_key(name, labels) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def escape_label_value(value) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """
+    Thread-safe counters and gauges, with labels, for everything generating playlists does in this process.
+    Exported in the Prometheus text format by to_prometheus()
+    """
+
+    def __init__(self, namespace="cardio_beats"):
+        self.namespace = namespace
+        self.counters: Dict[MetricKey, float] = {}
+        self.gauges: Dict[MetricKey, float] = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[metric_key(name, labels)] = value
+
+    def counter_values(self) -> Dict[MetricKey, float]:
+        with self.lock:
+            return dict(self.counters)
+
+    def to_prometheus(self) -> str:
+        with self.lock:
+            metrics = [("counter", self.counters), ("gauge", self.gauges)]
+            lines = []
+            for metric_type, values in metrics:
+                typed_names = set()
+                for (name, labels), value in sorted(values.items()):
+                    full_name = f"{self.namespace}_{name}"
+                    if full_name not in typed_names:
+                        typed_names.add(full_name)
+                        lines.append(f"# TYPE {full_name} {metric_type}")
+
+                    label_text = ",".join(
+                        f'{label}="{escape_label_value(label_value)}"'
+                        for label, label_value in labels
+                    )
+                    lines.append(f"{full_name}{{{label_text}}} {value:g}" if label_text else f"{full_name} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = None
+metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """
+    Return the metrics shared by everything in this process
+    """
+    global metrics
+    with metrics_lock:
+        if metrics is None:
+            metrics = Metrics()
+        return metrics
+
+
+# run values reported as the ratio of the first value to the sum of both
+value_ratios = {
+    "tempo_cache_hit_rate": ("tempo_cache_hits", "tempo_cache_misses"),
+}
+
+
+class RunMetrics:
+    """
+    Metrics of generating one playlist: seconds spent per phase, values such as cache hits and candidate
+    pool sizes, and the Spotify requests made since the run started. Phase times and added values are summed
+    into counters of the process-wide get_metrics(), set values and value_ratios into gauges holding
+    the value of the latest run; requests of other runs in the same process at the same time are counted too
+    """
+
+    def __init__(self):
+        self.process_metrics = get_metrics()
+        self.started = time.time()
+        self.counters_at_start = self.process_metrics.counter_values()
+        self.phase_seconds: Dict[str, float] = {}
+        self.values: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def add_phase_time(self, phase, seconds):
+        with self.lock:
+            self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+        self.process_metrics.increment("phase_seconds_total", seconds, phase=phase)
+
+    @contextmanager
+    def phase(self, phase):
+        """
+        Add the time spent inside the with block to phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase_time(phase, time.perf_counter() - start)
+
+    def timed_iter(self, phase, iterable: Iterable) -> Iterator:
+        """
+        Iterate over iterable, adding only the time spent waiting for its items to phase
+        """
+        seconds = 0.0
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                finally:
+                    seconds += time.perf_counter() - start
+                yield item
+        except StopIteration:
+            return
+        finally:
+            self.add_phase_time(phase, seconds)
+
+    def set(self, name, value):
+        """
+        Record a value of this run, such as a pool size, also set as the process-wide gauge name
+        """
+        with self.lock:
+            self.values[name] = value
+        self.process_metrics.set_gauge(name, value)
+
+    def add(self, name, value=1):
+        """
+        Add value to a count of this run, such as cache hits, also summed into the process-wide counter
+        name_total; the value_ratios the count is part of are set as process-wide gauges
+        """
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+            ratios = self.ratio_values()
+        self.process_metrics.increment(f"{name}_total", value)
+        for ratio_name, (part, other) in value_ratios.items():
+            if name in (part, other) and ratio_name in ratios:
+                self.process_metrics.set_gauge(ratio_name, ratios[ratio_name])
+
+    def ratio_values(self) -> Dict[str, float]:
+        """
+        The value_ratios of this run with a nonzero denominator; call with self.lock held
+        """
+        ratios = {}
+        for ratio_name, (part, other) in value_ratios.items():
+            total = self.values.get(part, 0) + self.values.get(other, 0)
+            if total:
+                ratios[ratio_name] = self.values.get(part, 0) / total
+        return ratios
+
+    def request_counts(self) -> Dict[str, Dict[str, float]]:
+        """
+        metric name -> labels -> increase since this run started, for the Spotify request counters
+        """
+        counts = {}
+        for (name, labels), value in self.process_metrics.counter_values().items():
+            if not name.startswith("spotify_"):
+                continue
+
+            increase = value - self.counters_at_start.get((name, labels), 0)
+            if increase:
+                label_text = ",".join(f"{label}={label_value}" for label, label_value in labels)
+                counts.setdefault(name, {})[label_text] = increase
+
+        return counts
+
+    def report(self) -> dict:
+        """
+        JSON-serializable report of the run
+        """
+        with self.lock:
+            values = dict(self.values)
+            values.update(self.ratio_values())
+
+            return {
+                "started": self.started,
+                "seconds": round(time.time() - self.started, 6),
+                "phase_seconds": {
+                    phase: round(seconds, 6)
+                    for phase, seconds in self.phase_seconds.items()
+                },
+                "values": values,
+                "spotify": self.request_counts(),
+            }
+
+
+@contextmanager
+def profiled(profile_path: Optional[str] = None, trace_memory=False) -> Iterator[dict]:
+    """
+    Opt-in profiling of the with block: with profile_path the cProfile stats are dumped there,
+    with trace_memory the tracemalloc peak is set as peak_traced_bytes of the dict yielded
+    """
+    results = {}
+    profiler = cProfile.Profile() if profile_path is not None else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield results
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if trace_memory:
+            results["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from collections import OrderedDict
+from track_store import TrackRecord
+from typing import Hashable, List, NamedTuple, Optional, Sequence
+
+# short intensity names accepted from users -> the name plans are cached under
+intensity_names = {
+    "f": "fat_burn",
+    "c": "cardio",
+    "p": "peak",
+}
+
+
+class CachedPlan(NamedTuple):
+    # tracks in play order with their bpms
+    tracks: List[TrackRecord]
+    bpms: List[float]
+
+    @property
+    def uris(self) -> List[str]:
+        return [track.uri for track in self.tracks]
+
+
+def plan_key(intensity, session_length, genres: Sequence[str], catalog_version, variant=0) -> Hashable:
+    """
+    Key of the plan for the preferences, the same however the intensity is abbreviated
+    and whatever the order or repetition of genres
+    """
+    return (
+        intensity_names.get(intensity, intensity),
+        int(session_length),
+        tuple(sorted(set(genres))),
+        catalog_version,
+        variant,
+    )
+
+
+def preset_name(intensity, session_length, genres: Sequence[str]) -> str:
+    """
+    Name of the preferences, the same however they are given, e.g. cardio-45-dance+pop
+    """
+    intensity, session_length, genres = plan_key(intensity, session_length, genres, None)[:3]
+    return f"{intensity}-{session_length}-{'+'.join(genres)}"
+
+
+class PlanCache:
+    """
+    Thread-safe LRU cache of playlist plans; plans expire ttl_seconds after they were cached
+    and the least recently used plan is evicted beyond max_size plans
+    """
+
+    def __init__(self, max_size=256, ttl_seconds=15 * 60):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.plans = OrderedDict()  # key -> (expiry, CachedPlan)
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.plans)
+
+    def get(self, key) -> Optional[CachedPlan]:
+        with self.lock:
+            entry = self.plans.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self.plans[key]
+                return None
+
+            self.plans.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, plan: CachedPlan):
+        with self.lock:
+            self.plans[key] = (time.monotonic() + self.ttl_seconds, plan)
+            self.plans.move_to_end(key)
+            while len(self.plans) > self.max_size:
+                self.plans.popitem(last=False)
+
+
+plan_cache = None
+plan_cache_lock = threading.Lock()
+
+
+def get_plan_cache(**options) -> PlanCache:
+    """
+    Return the plan cache shared by every playlist generated in this process, created with options on first use
+    """
+    global plan_cache
+    with plan_cache_lock:
+        if plan_cache is None:
+            plan_cache = PlanCache(**options)
+        return plan_cache
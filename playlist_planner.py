@@ -0,0 +1,323 @@
+import numpy as np
+
+from track_index import BpmIndex
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+milliseconds_per_second = 1000
+milliseconds_per_minute = 60000
+
+# a track also fits a cadence at half or double its tempo, e.g. a 75 bpm track for a 150 bpm cadence;
+# in order of preference
+tempo_multiples = (1.0, 0.5, 2.0)
+# how many of the zone tracks just above the lowest one a session plan tries ending its hold on
+end_choices = 8
+
+
+class SessionPlan(NamedTuple):
+    # positions into the bpms and durations the plan was made from, in play order per phase
+    warmup: List[int]
+    hold: List[int]
+    cooldown: List[int]
+    duration_ms: int
+    # position -> the multiple of its bpm each track was planned at, see tempo_multiples
+    multiples: Dict[int, float]
+    # how much shorter than the session length, less the tolerance, the plan is; 0 when the tracks fill it
+    shortfall_ms: int
+
+    @property
+    def order(self) -> List[int]:
+        return self.warmup + self.hold + self.cooldown
+
+    def planned_bpms(self, bpms) -> np.ndarray:
+        """
+        The bpms the tracks of the plan are played at, in play order, given the bpms it was made from
+        """
+        order = self.order
+        multiples = np.array([self.multiples.get(position, 1.0) for position in order])
+        return np.asarray(bpms, dtype=float)[np.array(order, dtype=np.int64)] * multiples
+
+
+def fold_tempos(
+    bpms,
+    low_bpm,
+    high_bpm,
+    multiples: Sequence[float] = tempo_multiples,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every effective tempo of bpms strictly between low_bpm and high_bpm at one of multiples,
+    as the positions into bpms, the effective tempos and the multiples they are at.
+    A track has one effective tempo per multiple that lands in the range; NaN bpms have none
+    """
+    bpms = np.asarray(bpms, dtype=float)
+    multiples = np.asarray(multiples, dtype=float)
+    effective_bpms = np.multiply.outer(bpms, multiples)
+    positions, columns = np.nonzero((low_bpm < effective_bpms) & (effective_bpms < high_bpm))
+    return positions, effective_bpms[positions, columns], multiples[columns]
+
+
+def plan_session(
+    bpms,
+    durations_ms,
+    min_bpm,
+    max_bpm,
+    session_length_ms,
+    resting_bpm=75,
+    max_bpm_step=15,
+    cooldown_ms=5 * milliseconds_per_minute,
+    tolerance_ms=30 * milliseconds_per_second,
+    seed=None,
+    multiples: Sequence[float] = tempo_multiples,
+) -> SessionPlan:
+    """
+    Pick and order tracks for a session of session_length_ms:
+        - warmup: ascending from resting_bpm towards min_bpm in steps of at most max_bpm_step
+        - hold: tracks in the min_bpm - max_bpm zone whose total duration fills the rest of the session
+          within tolerance_ms, ordered up to their peak and back down
+        - cooldown: descending from the last hold track towards halfway between min_bpm and resting_bpm
+          during the last cooldown_ms of the session
+    No two consecutive tracks, across phases too, are more than max_bpm_step apart. The cooldown takes at
+    most a quarter of the session and the warmup at most half of what remains. Tracks are planned at one of
+    multiples of their bpm, preferring the order they were given in, or an order shuffled by seed.
+    When the tracks cannot fill the session the plan is shorter, by shortfall_ms
+    """
+    bpms = np.asarray(bpms, dtype=float)
+    durations_ms = np.asarray(durations_ms, dtype=np.int64)
+
+    candidates, effective_bpms, candidate_multiples = fold_tempos(bpms, resting_bpm, max_bpm, multiples)
+    tracks_by_bpm = BpmIndex([
+        {"bpm": bpm, "index": index, "multiple": multiple}
+        for bpm, index, multiple in zip(
+            effective_bpms.tolist(), candidates.tolist(), candidate_multiples.tolist()
+        )
+    ])
+    # a track is in the index once per multiple; planning it at one removes the others
+    positions_by_index = {}
+    for position, track in enumerate(tracks_by_bpm.tracks):
+        positions_by_index.setdefault(track["index"], []).append(position)
+
+    planned_multiples = {}
+
+    def take(track):
+        for position in positions_by_index[track["index"]]:
+            tracks_by_bpm.remove(position)
+        planned_multiples[track["index"]] = track["multiple"]
+
+    def up_to(bpm):
+        # the upper bound of a bpm range that includes bpm but nothing at or above max_bpm
+        return min(np.nextafter(bpm, np.inf), max_bpm)
+
+    cooldown_budget_ms = min(session_length_ms / 4, cooldown_ms)
+    lowest_cooldown_bpm = (min_bpm + resting_bpm) / 2
+
+    def duration_of(tracks) -> int:
+        return sum(int(durations_ms[track["index"]]) for track in tracks)
+
+    # the hold starts from the lowest zone track
+    lowest = None
+    position = tracks_by_bpm.first_in_range(np.nextafter(min_bpm, -np.inf), max_bpm)
+    if position is not None and duration_of([tracks_by_bpm.tracks[position]]) <= session_length_ms - cooldown_budget_ms:
+        lowest = tracks_by_bpm.tracks[position]
+        take(lowest)
+    lowest_ms = duration_of([lowest]) if lowest is not None else 0
+
+    # the warmup leads up to it, planned from the top down so that it joins the hold even when its budget runs out
+    warmup_budget_ms = min(
+        (session_length_ms - cooldown_budget_ms) / 2,
+        session_length_ms - cooldown_budget_ms - lowest_ms,
+    )
+    warmup_tracks = []
+    warmup_ms = 0
+    previous_bpm = lowest["bpm"] if lowest is not None else min_bpm
+    while previous_bpm - max_bpm_step > resting_bpm:
+        # take the largest step down so the warmup has as few tracks as possible;
+        # a track over the budget is left in the index
+        position = tracks_by_bpm.first_in_range(previous_bpm - max_bpm_step, previous_bpm)
+        if position is None:
+            break
+        track = tracks_by_bpm.tracks[position]
+        if warmup_ms + durations_ms[track["index"]] > warmup_budget_ms:
+            break
+
+        take(track)
+        warmup_tracks.append(track)
+        warmup_ms += int(durations_ms[track["index"]])
+        previous_bpm = track["bpm"]
+    warmup = [track["index"] for track in reversed(warmup_tracks)]
+
+    # the rest is planned for a few choices of the track the hold ends on, without taking tracks until one is chosen;
+    # as order_peak steps between every other track by bpm, any three neighbouring hold bpms are kept within a step
+
+    def cooldown_from(previous_bpm) -> List[dict]:
+        """
+        The cooldown following a track at previous_bpm
+        """
+        tracks = []
+        while duration_of(tracks) < cooldown_budget_ms and previous_bpm > lowest_cooldown_bpm:
+            position = tracks_by_bpm.first_in_range(
+                max(previous_bpm - max_bpm_step, lowest_cooldown_bpm), previous_bpm
+            )
+            if position is None:
+                break
+
+            tracks.append(tracks_by_bpm.tracks[position])
+            previous_bpm = tracks[-1]["bpm"]
+
+        return tracks
+
+    def climb_from(below_bpm, top_bpm, excluded) -> List[dict]:
+        """
+        The tracks climbing from below_bpm and top_bpm in the largest steps that keep the hold's steps small
+        """
+        tracks = []
+        while True:
+            position = tracks_by_bpm.last_in_range(top_bpm, up_to(below_bpm + max_bpm_step))
+            if position is None or tracks_by_bpm.tracks[position]["index"] in excluded:
+                return tracks
+
+            tracks.append(tracks_by_bpm.tracks[position])
+            excluded = excluded | {tracks[-1]["index"]}
+            below_bpm, top_bpm = top_bpm, tracks[-1]["bpm"]
+
+    def fill_candidates(low_bpm, high_bpm, excluded) -> Tuple[Dict[int, dict], np.ndarray]:
+        """
+        index -> the track at its most preferred multiple between low_bpm and high_bpm inclusive,
+        and the indices not in excluded in order of preference
+        """
+        hold_tracks = {}
+        for position in tracks_by_bpm.iter_range(np.nextafter(low_bpm, -np.inf), up_to(high_bpm)):
+            track = tracks_by_bpm.tracks[position]
+            if track["index"] in excluded:
+                continue
+            if track["index"] not in hold_tracks or track["multiple"] == 1:
+                hold_tracks[track["index"]] = track
+
+        candidates = np.sort(np.array(list(hold_tracks), dtype=np.int64))
+        if seed is not None:
+            candidates = np.random.default_rng(seed).permutation(candidates)
+        # tracks at their own bpm first, each group in the order above
+        folded = np.array([hold_tracks[index]["multiple"] != 1 for index in candidates.tolist()], dtype=bool)
+        return hold_tracks, candidates[np.argsort(folded, kind="stable")]
+
+    def plan_rest(end) -> Tuple[int, List[dict], List[dict]]:
+        """
+        How far from the session length the plan is, the hold tracks after the lowest one and the cooldown,
+        for a hold ending on end, or on the lowest track when end is None
+        """
+        cooldown_tracks = cooldown_from(end["bpm"] if end is not None else lowest["bpm"])
+        hold_budget_ms = session_length_ms - warmup_ms - lowest_ms - duration_of(cooldown_tracks)
+        if end is None:
+            return abs(hold_budget_ms), [], cooldown_tracks
+
+        hold_budget_ms -= duration_of([end])
+        excluded = {track["index"] for track in cooldown_tracks} | {end["index"]}
+        climb = climb_from(lowest["bpm"], end["bpm"], excluded)
+
+        # climb as high as still lets the hold be filled within tolerance_ms
+        best = None
+        for climb_length in range(len(climb), -1, -1):
+            climbed = climb[:climb_length]
+            fill_budget_ms = hold_budget_ms - duration_of(climbed)
+            if fill_budget_ms < 0 and climb_length:
+                continue
+
+            highest_bpm = max(([end] + climbed)[-1]["bpm"], lowest["bpm"] + max_bpm_step)
+            hold_tracks, candidates = fill_candidates(
+                end["bpm"], highest_bpm, excluded | {track["index"] for track in climbed}
+            )
+            fill = choose_durations(durations_ms[candidates], fill_budget_ms, tolerance_ms)
+            miss_ms = abs(fill_budget_ms - int(durations_ms[candidates[fill]].sum()))
+            if best is None or miss_ms < best[0]:
+                best = (miss_ms, [end] + climbed + [hold_tracks[index] for index in candidates[fill].tolist()])
+            if miss_ms <= tolerance_ms:
+                break
+
+        return best + (cooldown_tracks,)
+
+    if lowest is None:
+        rest = (0, [], cooldown_from(warmup_tracks[0]["bpm"] if warmup_tracks else resting_bpm))
+    else:
+        rest = None
+        # the track the hold ends on is the next zone track up, else one of the few after it
+        ends = tracks_by_bpm.iter_range(np.nextafter(lowest["bpm"], -np.inf), up_to(lowest["bpm"] + max_bpm_step))
+        for _, position in zip(range(end_choices), ends):
+            end = tracks_by_bpm.tracks[position]
+            if lowest_ms + warmup_ms + duration_of([end]) > session_length_ms - cooldown_budget_ms:
+                continue
+
+            planned = plan_rest(end)
+            if rest is None or planned[0] < rest[0]:
+                rest = planned
+            if rest[0] <= tolerance_ms:
+                break
+
+        if rest is None:
+            rest = plan_rest(None)
+
+    _, hold_tracks, cooldown_tracks = rest
+    hold_tracks = ([lowest] if lowest is not None else []) + hold_tracks
+    for track in hold_tracks + cooldown_tracks:
+        take(track)
+
+    hold_bpms = bpms.copy()
+    for track in hold_tracks:
+        hold_bpms[track["index"]] = track["bpm"]
+    hold = order_peak(np.array([track["index"] for track in hold_tracks], dtype=np.int64), hold_bpms)
+    cooldown = [track["index"] for track in cooldown_tracks]
+    cooldown_ms_total = duration_of(cooldown_tracks)
+
+    duration_ms = warmup_ms + cooldown_ms_total + int(durations_ms[hold].sum())
+    return SessionPlan(
+        warmup=warmup,
+        hold=hold,
+        cooldown=cooldown,
+        duration_ms=duration_ms,
+        multiples=planned_multiples,
+        shortfall_ms=max(int(session_length_ms - tolerance_ms - duration_ms), 0),
+    )
+
+
+def choose_durations(durations_ms, target_ms, tolerance_ms) -> np.ndarray:
+    """
+    Return the positions of a subset of durations_ms whose sum is as close as possible to target_ms,
+    preferring earlier durations. Sums are compared in whole seconds
+    """
+    durations = np.maximum(np.rint(durations_ms / milliseconds_per_second).astype(np.int64), 1)
+    target = max(int(round(target_ms / milliseconds_per_second)), 0)
+    max_total = target + int(tolerance_ms // milliseconds_per_second)
+
+    reachable = np.zeros(max_total + 1, dtype=bool)
+    reachable[0] = True
+    # added_by[total] is the position of the duration that first made total reachable;
+    # the rest of that total was reachable with earlier durations only
+    added_by = np.full(max_total + 1, -1, dtype=np.int64)
+
+    for position, duration in enumerate(durations.tolist()):
+        if reachable[target]:
+            break
+        if duration > max_total:
+            continue
+
+        newly_reachable = reachable[:-duration] & ~reachable[duration:]
+        added_by[duration:][newly_reachable] = position
+        reachable[duration:] |= newly_reachable
+
+    reachable_totals = np.flatnonzero(reachable)
+    total = int(reachable_totals[np.argmin(np.abs(reachable_totals - target))])
+
+    chosen = []
+    while total > 0:
+        position = int(added_by[total])
+        chosen.append(position)
+        total -= int(durations[position])
+
+    return np.array(chosen[::-1], dtype=np.int64)
+
+
+def order_peak(indices, bpms) -> List[int]:
+    """
+    Order indices by bpm rising to the highest bpm through every other index and falling back down through
+    the rest, ending next to the lowest bpm. The largest step is the largest difference between bpms two apart
+    in sorted order, the smallest any such order can have
+    """
+    ascending = indices[np.argsort(bpms[indices], kind="stable")]
+    return ascending[0::2].tolist() + ascending[1::2][::-1].tolist()
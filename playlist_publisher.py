@@ -0,0 +1,47 @@
+from request_scheduler import INTERACTIVE
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    import spotipy
+
+# maximum number of items accepted by one add or replace playlist items request
+max_items_per_request = 100
+
+
+class PlaylistPublisher:
+    """
+    Uploads the tracks of a playlist in chunks of at most max_items_per_request uris, one request at a time,
+    each chunk inserted at its position in the playlist.
+    Adding chunks concurrently would land them in whatever order their requests complete, and reading the
+    playlist back and moving the chunks into place costs more requests than the concurrency saves
+    """
+
+    def __init__(self, spotify_client: "spotipy.Spotify", chunk_size=max_items_per_request):
+        self.spotify_client = spotify_client
+        self.chunk_size = chunk_size
+
+    def publish(self, playlist_id, uris: List[str], replace=False):
+        """
+        Add uris to playlist_id in order; with replace the tracks it held before are removed first
+        """
+        chunks = [
+            uris[start:start + self.chunk_size]
+            for start in range(0, len(uris), self.chunk_size)
+        ]
+
+        from http_session import get_spotify_session
+
+        with get_spotify_session().scheduler.priority(INTERACTIVE):
+            added_chunks = chunks
+            position = None
+            if replace:
+                # the first chunk replaces the old tracks, the others are inserted after it
+                self.spotify_client.playlist_replace_items(playlist_id, chunks[0] if chunks else [])
+                added_chunks = chunks[1:]
+                position = len(chunks[0]) if chunks else 0
+
+            for chunk in added_chunks:
+                # without replace, uris are appended after the tracks playlist_id already holds
+                self.spotify_client.playlist_add_items(playlist_id, chunk, position=position)
+                if position is not None:
+                    position += len(chunk)
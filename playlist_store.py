@@ -0,0 +1,98 @@
+from tempo_cache import setup_django
+from track_store import TrackRecord
+from typing import List, Optional, Sequence
+
+
+class PlaylistStore:
+    """
+    Persists generated playlists, their songs and the order of the songs in the spotify_app tables.
+    A playlist is written in one transaction with a constant number of bulk queries, whatever its length
+    """
+
+    # SQLite limits the number of parameters in a single query
+    query_batch_size = 500
+
+    def __init__(self):
+        setup_django()
+        from django.db import transaction
+        from spotify_app.models import Playlist, PlaylistTrack, Song
+
+        self.transaction = transaction
+        self.playlist_model = Playlist
+        self.playlist_track_model = PlaylistTrack
+        self.song_model = Song
+
+    def save(
+        self,
+        playlist_id,
+        name,
+        tracks: Sequence[TrackRecord],
+        bpms: Sequence[Optional[float]],
+        user_id="",
+        preset="",
+    ):
+        """
+        Save playlist playlist_id holding tracks in order, upserting the songs with their bpms
+        and replacing any tracks the playlist held before
+        """
+        songs = {
+            track.id: self.song_model(
+                id=track.id,
+                bpm=bpm,
+                uri=track.uri,
+                duration=track.duration or None,
+                name=track.name[:200],
+            )
+            for track, bpm in zip(tracks, bpms)
+        }
+
+        with self.transaction.atomic():
+            playlist, _ = self.playlist_model.objects.update_or_create(
+                id=playlist_id,
+                defaults={"name": name, "user_id": user_id, "preset": preset}
+            )
+
+            # Django 3.2 has no upsert: insert the new songs, then update every song in bulk
+            self.song_model.objects.bulk_create(
+                songs.values(),
+                batch_size=self.query_batch_size,
+                ignore_conflicts=True
+            )
+            self.song_model.objects.bulk_update(
+                songs.values(),
+                ["bpm", "uri", "duration", "name"],
+                batch_size=self.query_batch_size
+            )
+
+            self.playlist_track_model.objects.filter(playlist=playlist).delete()
+            self.playlist_track_model.objects.bulk_create(
+                [
+                    self.playlist_track_model(playlist=playlist, song_id=track.id, position=position)
+                    for position, track in enumerate(tracks)
+                ],
+                batch_size=self.query_batch_size
+            )
+
+        return playlist
+
+    def find(self, user_id, preset):
+        """
+        The playlist last generated for user_id from the preferences named preset, or None
+        """
+        return (
+            self.playlist_model.objects
+            .filter(user_id=user_id, preset=preset)
+            .order_by("-created")
+            .first()
+        )
+
+    def track_ids(self, playlist_id) -> List[str]:
+        """
+        Ids of the songs of playlist_id in playlist order
+        """
+        return list(
+            self.playlist_track_model.objects
+            .filter(playlist_id=playlist_id)
+            .order_by("position")
+            .values_list("song_id", flat=True)
+        )
@@ -0,0 +1,176 @@
+import threading
+import time
+
+from bisect import insort
+from contextlib import contextmanager
+from itertools import count
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+# priority classes, lower is served first
+INTERACTIVE = 0
+DEFAULT = 1
+BACKGROUND = 2
+
+# path segments naming Spotify resources; everything else in a path is an id
+resource_names = {
+    "api",
+    "artists",
+    "audio-analysis",
+    "audio-features",
+    "authorize",
+    "items",
+    "me",
+    "playlists",
+    "recommendations",
+    "token",
+    "top",
+    "tracks",
+    "users",
+}
+
+# (requests per second, burst) for endpoints that need a tighter budget than the global one
+default_endpoint_rates = {
+    "audio-analysis": (2.0, 5),
+}
+
+
+def endpoint_name(url) -> str:
+    """
+    Name of the endpoint url belongs to with the ids left out, e.g. playlists/tracks
+    """
+    return "/".join(
+        segment
+        for segment in urlparse(url).path.split("/")
+        if segment in resource_names
+    )
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def fill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now) -> float:
+        """
+        Seconds until a token is available
+        """
+        self.fill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RequestScheduler:
+    """
+    Paces every Spotify request through a global token bucket and optional per-endpoint buckets.
+    Waiting requests are let through by priority class, then in arrival order; a request whose endpoint
+    has no budget left does not hold up lower priority requests to other endpoints.
+    The global rate halves on every 429, pausing all requests for its Retry-After,
+    and grows back by rate_increase per successful response up to max_rate
+    """
+
+    def __init__(
+        self,
+        rate=10.0,
+        burst=20,
+        endpoint_rates: Optional[Dict[str, Tuple[float, int]]] = None,
+        min_rate=0.5,
+        max_rate=50.0,
+        rate_increase=0.05,
+    ):
+        self.global_bucket = TokenBucket(rate, burst)
+        # endpoint name -> (rate, burst)
+        self.endpoint_buckets = {
+            endpoint: TokenBucket(endpoint_rate, endpoint_burst)
+            for endpoint, (endpoint_rate, endpoint_burst) in (endpoint_rates or {}).items()
+        }
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_increase = rate_increase
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+        self.waiting = []  # sorted (priority, arrival, endpoint)
+        self.arrivals = count()
+        self.local = threading.local()
+
+    @property
+    def current_priority(self) -> int:
+        return getattr(self.local, "priority", DEFAULT)
+
+    @contextmanager
+    def priority(self, priority):
+        """
+        Send the requests made by this thread inside the with block with priority
+        """
+        previous_priority = self.current_priority
+        self.local.priority = priority
+        try:
+            yield
+        finally:
+            self.local.priority = previous_priority
+
+    def endpoint_wait_time(self, endpoint, now) -> float:
+        bucket = self.endpoint_buckets.get(endpoint)
+        return 0.0 if bucket is None else bucket.wait_time(now)
+
+    def acquire(self, endpoint, priority=None):
+        """
+        Block until a request to endpoint may be sent
+        """
+        if priority is None:
+            priority = self.current_priority
+
+        with self.condition:
+            ticket = (priority, next(self.arrivals), endpoint)
+            insort(self.waiting, ticket)
+
+            while True:
+                now = time.monotonic()
+                wait_time = max(self.paused_until - now, self.global_bucket.wait_time(now))
+
+                if wait_time == 0:
+                    next_ticket = None
+                    for waiting_ticket in self.waiting:
+                        endpoint_wait_time = self.endpoint_wait_time(waiting_ticket[2], now)
+                        if endpoint_wait_time == 0:
+                            next_ticket = waiting_ticket
+                            break
+                        wait_time = endpoint_wait_time if wait_time == 0 else min(wait_time, endpoint_wait_time)
+
+                    if next_ticket == ticket:
+                        self.waiting.remove(ticket)
+                        self.global_bucket.tokens -= 1
+                        if endpoint in self.endpoint_buckets:
+                            self.endpoint_buckets[endpoint].tokens -= 1
+                        self.condition.notify_all()
+                        return
+
+                    if next_ticket is not None:
+                        # another request goes first; wake it, it wakes the others once it has gone
+                        self.condition.notify_all()
+                        self.condition.wait()
+                        continue
+
+                self.condition.wait(wait_time)
+
+    def record_response(self, status_code, retry_after=0.0):
+        """
+        Adapt the global rate to a response Spotify sent
+        """
+        with self.condition:
+            bucket = self.global_bucket
+            if status_code == 429:
+                bucket.fill(time.monotonic())
+                bucket.rate = max(self.min_rate, bucket.rate / 2)
+                bucket.tokens = min(bucket.tokens, 0)
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            elif status_code < 400:
+                bucket.fill(time.monotonic())
+                bucket.rate = min(self.max_rate, bucket.rate + self.rate_increase)
+
+            self.condition.notify_all()
@@ -0,0 +1,333 @@
+import numpy as np
+import threading
+
+from heapq import heappop, heappush, heapreplace
+from tempo_cache import audio_feature_names, setup_django
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# a difference of bpm_scale bpm weighs as much as the whole range of one audio feature
+bpm_scale = 40.0
+# value of an audio feature Spotify has none for
+default_feature_value = 0.5
+
+
+def closest_accepted(distances: np.ndarray, k, accept: Callable[[int], bool]) -> List[Tuple[float, int]]:
+    """
+    (distance, position) of the k smallest finite distances whose positions are accepted, closest first.
+    Only the closest few are sorted, more of them each time too many are not accepted
+    """
+    candidates = np.flatnonzero(distances < np.inf)
+    count = k
+    while True:
+        closest = candidates
+        if count < len(candidates):
+            closest = candidates[np.argpartition(distances[candidates], count)[:count]]
+        closest = closest[np.argsort(distances[closest])]
+
+        accepted = [
+            (float(distances[position]), position)
+            for position in closest.tolist()
+            if accept(position)
+        ][:k]
+        if len(accepted) == k or len(closest) == len(candidates):
+            return accepted
+        count *= 4
+
+
+class KDTree:
+    """
+    Static k-d tree over the rows of points, split at the median of their widest dimension down to leaves of
+    at most leaf_size rows. Every node keeps the bounding box of its rows, so that nearest neighbour queries
+    skip the nodes outside the window asked for or farther away than the neighbours found so far
+    """
+
+    leaf_size = 256
+
+    def __init__(self, points: np.ndarray):
+        self.order = np.arange(len(points))
+        # per node: the range of self.order it covers, its children, -1 for leaves, and its bounding box
+        self.starts = []
+        self.ends = []
+        self.lefts = []
+        self.rights = []
+        lows = []
+        highs = []
+
+        def add_node(start, end) -> int:
+            rows = self.order[start:end]
+            self.starts.append(start)
+            self.ends.append(end)
+            self.lefts.append(-1)
+            self.rights.append(-1)
+            lows.append(points[rows].min(axis=0))
+            highs.append(points[rows].max(axis=0))
+            return len(self.starts) - 1
+
+        nodes = [add_node(0, len(points))] if len(points) else []
+        while nodes:
+            node = nodes.pop()
+            start, end = self.starts[node], self.ends[node]
+            if end - start <= self.leaf_size:
+                continue
+
+            dimension = int(np.argmax(highs[node] - lows[node]))
+            middle = (start + end) // 2
+            rows = self.order[start:end]
+            self.order[start:end] = rows[np.argpartition(points[rows, dimension], middle - start)]
+            self.lefts[node] = add_node(start, middle)
+            self.rights[node] = add_node(middle, end)
+            nodes.extend((self.lefts[node], self.rights[node]))
+
+        # the points in tree order, so that the points of a leaf are a slice
+        self.points = points[self.order]
+        # plain lists of floats are faster than NumPy for the few dimensions compared per node
+        self.lows = [low.tolist() for low in lows]
+        self.highs = [high.tolist() for high in highs]
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def nearest(self, point: np.ndarray, k, low, high, accept: Callable[[int], bool]) -> List[Tuple[float, int]]:
+        """
+        Return (squared distance, row) of the k accepted rows closest to point among the rows whose first
+        coordinate is between low and high inclusive, closest first. Nodes are visited closest first,
+        stopping once no node left can be closer than the kth row found
+        """
+        if not self.starts:
+            return []
+
+        point_values = point.tolist()
+        # max heap of the closest rows found, by negated distance
+        found = []
+        nodes = [(0.0, 0)]
+        while nodes:
+            distance, node = heappop(nodes)
+            if len(found) == k and distance >= -found[0][0]:
+                break
+
+            if self.lefts[node] == -1:
+                start, end = self.starts[node], self.ends[node]
+                points = self.points[start:end]
+                differences = points - point
+                distances = np.einsum("ij,ij->i", differences, differences)
+                distances[(points[:, 0] < low) | (points[:, 0] > high)] = np.inf
+                if len(found) == k:
+                    distances[distances >= -found[0][0]] = np.inf
+                # rows not accepted do not count towards k, so the leaf is scanned until k rows are accepted
+                for position in np.argsort(distances).tolist():
+                    row_distance = float(distances[position])
+                    if row_distance == np.inf or len(found) == k and row_distance >= -found[0][0]:
+                        break
+
+                    row = int(self.order[start + position])
+                    if not accept(row):
+                        continue
+                    if len(found) == k:
+                        heapreplace(found, (-row_distance, row))
+                    else:
+                        heappush(found, (-row_distance, row))
+                continue
+
+            for child in (self.lefts[node], self.rights[node]):
+                child_lows = self.lows[child]
+                child_highs = self.highs[child]
+                first_low = max(child_lows[0], low)
+                first_high = min(child_highs[0], high)
+                if first_low > first_high:
+                    continue
+
+                value = point_values[0]
+                child_distance = (first_low - value) ** 2 if value < first_low else (
+                    (value - first_high) ** 2 if value > first_high else 0.0
+                )
+                for value, child_low, child_high in zip(point_values[1:], child_lows[1:], child_highs[1:]):
+                    if value < child_low:
+                        child_distance += (child_low - value) ** 2
+                    elif value > child_high:
+                        child_distance += (value - child_high) ** 2
+                heappush(nodes, (child_distance, child))
+
+        return sorted((-negated_distance, row) for negated_distance, row in found)
+
+
+class SimilarityIndex:
+    """
+    Nearest neighbour search over tracks by bpm and audio features, see audio_feature_names.
+    Tracks added after the k-d tree was built are kept in a tail searched by brute force; the tree is rebuilt
+    over every track once the tail holds more than rebuild_fraction of them, so adding tracks one by one
+    costs O(log n) amortized per track
+    """
+
+    rebuild_fraction = 0.1
+    min_rebuild_size = 1024
+
+    def __init__(self, capacity=1024):
+        dimensions = 1 + len(audio_feature_names)
+        self.ids = []
+        # track id -> its row; a track added again gets a new row and its old one is masked out
+        self.rows = {}
+        self.points = np.zeros((capacity, dimensions))
+        self.present = np.zeros(capacity, dtype=bool)
+        self.tree = KDTree(self.points[:0])
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, track_id) -> bool:
+        return track_id in self.rows
+
+    @staticmethod
+    def vector(bpm, features: Optional[Dict[str, Optional[float]]] = None) -> np.ndarray:
+        features = features or {}
+        return np.array(
+            [bpm / bpm_scale] + [
+                default_feature_value if features.get(name) is None else features[name]
+                for name in audio_feature_names
+            ]
+        )
+
+    def features_of(self, track_id) -> Optional[np.ndarray]:
+        """
+        The vector track_id is indexed with, or None when it is not in the index
+        """
+        row = self.rows.get(track_id)
+        return None if row is None else self.points[row].copy()
+
+    def add(self, track_id, bpm, features: Optional[Dict[str, Optional[float]]] = None):
+        """
+        Index track_id with bpm and its audio features, replacing the vector it was indexed with before
+        """
+        self.add_many([track_id], [bpm], [features])
+
+    def add_many(
+        self,
+        track_ids: Sequence[str],
+        bpms: Sequence[float],
+        features: Sequence[Optional[Dict[str, Optional[float]]]],
+    ):
+        """
+        add() every track of track_ids at once
+        """
+        vectors = np.array([self.vector(bpm, track_features) for bpm, track_features in zip(bpms, features)])
+        with self.lock:
+            new_track_ids = []
+            new_vectors = []
+            for track_id, vector in zip(track_ids, vectors):
+                row = self.rows.get(track_id)
+                if row is not None:
+                    if np.array_equal(self.points[row], vector):
+                        continue
+                    self.present[row] = False
+                new_track_ids.append(track_id)
+                new_vectors.append(vector)
+
+            start = len(self.ids)
+            end = start + len(new_track_ids)
+            while end > len(self.points):
+                self.points = np.concatenate([self.points, np.zeros_like(self.points)])
+                self.present = np.concatenate([self.present, np.zeros_like(self.present)])
+
+            self.ids.extend(new_track_ids)
+            self.rows.update(zip(new_track_ids, range(start, end)))
+            if new_vectors:
+                self.points[start:end] = new_vectors
+            self.present[start:end] = True
+
+            tail_size = len(self.ids) - len(self.tree)
+            if tail_size > max(self.min_rebuild_size, self.rebuild_fraction * len(self.tree)):
+                self.rebuild()
+
+    def rebuild(self):
+        """
+        Rebuild the k-d tree over every row, dropping the rows of tracks added again since
+        """
+        live_rows = np.flatnonzero(self.present[:len(self.ids)])
+        self.ids = [self.ids[row] for row in live_rows.tolist()]
+        self.rows = {track_id: row for row, track_id in enumerate(self.ids)}
+        points = np.zeros_like(self.points)
+        points[:len(live_rows)] = self.points[live_rows]
+        self.points = points
+        self.present = np.zeros_like(self.present)
+        self.present[:len(live_rows)] = True
+        self.tree = KDTree(self.points[:len(live_rows)])
+
+    def nearest(self, vector: np.ndarray, k=5, bpm_low=-np.inf, bpm_high=np.inf, exclude=frozenset()) -> List[str]:
+        """
+        Ids of the k tracks closest to vector, see SimilarityIndex.vector, among the tracks with a bpm
+        strictly between bpm_low and bpm_high that are not in exclude, closest first
+        """
+        low = np.nextafter(bpm_low / bpm_scale, np.inf)
+        high = np.nextafter(bpm_high / bpm_scale, -np.inf)
+
+        with self.lock:
+            def accept(row) -> bool:
+                return bool(self.present[row]) and self.ids[row] not in exclude
+
+            found = self.tree.nearest(vector, k, low, high, accept)
+
+            tail_points = self.points[len(self.tree):len(self.ids)]
+            tail_rows = len(self.tree) + np.flatnonzero((low <= tail_points[:, 0]) & (tail_points[:, 0] <= high))
+            differences = self.points[tail_rows] - vector
+            distances = np.einsum("ij,ij->i", differences, differences)
+            found.extend(
+                (distance, int(tail_rows[position]))
+                for distance, position in closest_accepted(
+                    distances, k, lambda position: accept(int(tail_rows[position]))
+                )
+            )
+
+            return [self.ids[row] for _, row in sorted(found)[:k]]
+
+    def nearest_to_track(self, track_id, k=5, bpm_low=-np.inf, bpm_high=np.inf, exclude=frozenset()) -> List[str]:
+        """
+        Ids of the k tracks most like track_id, with a bpm strictly between bpm_low and bpm_high, closest first.
+        Tracks are compared by their audio features at the bpm halfway through the range;
+        a track_id that is None or not in the index is compared as a track with average features
+        """
+        vector = self.features_of(track_id) if track_id is not None else None
+        if vector is None:
+            vector = self.vector(0)
+        if np.isfinite(bpm_low) and np.isfinite(bpm_high):
+            vector[0] = (bpm_low + bpm_high) / 2 / bpm_scale
+        return self.nearest(vector, k, bpm_low, bpm_high, exclude)
+
+
+def load_similarity_index() -> SimilarityIndex:
+    """
+    Index every track in the tempo cache with a bpm and audio features. Tracks cached before their features
+    were are left out, as with the default_feature_value of every feature they would match on bpm alone
+    """
+    setup_django()
+    from spotify_app.models import Song
+
+    songs = list(
+        Song.objects.filter(
+            bpm__isnull=False,
+            **{f"{name}__isnull": False for name in audio_feature_names}
+        ).values_list("id", "bpm", *audio_feature_names)
+    )
+    index = SimilarityIndex(capacity=max(len(songs), 1024))
+    index.add_many(
+        [song[0] for song in songs],
+        [song[1] for song in songs],
+        [dict(zip(audio_feature_names, song[2:])) for song in songs],
+    )
+    index.rebuild()
+
+    return index
+
+
+similarity_index = None
+similarity_index_lock = threading.Lock()
+
+
+def get_similarity_index() -> SimilarityIndex:
+    """
+    Return the similarity index shared by everything in this process, loaded from the tempo cache on first use
+    """
+    global similarity_index
+    with similarity_index_lock:
+        if similarity_index is None:
+            similarity_index = load_similarity_index()
+        return similarity_index
@@ -0,0 +1,42 @@
+from tempo_cache import setup_django
+from typing import Dict, Iterable, List, Tuple
+
+
+class SnapshotStore:
+    """
+    The snapshot id and track ids of every genre playlist as it was last synced,
+    persisted in the spotify_app PlaylistSnapshot table
+    """
+
+    def __init__(self):
+        setup_django()
+        from django.db import transaction
+        from spotify_app.models import PlaylistSnapshot
+
+        self.transaction = transaction
+        self.snapshot_model = PlaylistSnapshot
+
+    def load(self, playlist_ids: Iterable[str]) -> Dict[str, Tuple[str, List[str]]]:
+        """
+        Return playlist id -> (snapshot id, track ids) for the playlists of playlist_ids synced before
+        """
+        return {
+            playlist_id: (snapshot_id, track_ids)
+            for playlist_id, snapshot_id, track_ids in self.snapshot_model.objects.filter(
+                playlist_id__in=list(playlist_ids)
+            ).values_list("playlist_id", "snapshot_id", "track_ids")
+        }
+
+    def save(self, snapshots: Dict[str, Tuple[str, List[str]]]):
+        """
+        Replace the stored snapshots of the playlists in snapshots, a dict like the one load returns
+        """
+        if not snapshots:
+            return
+
+        with self.transaction.atomic():
+            self.snapshot_model.objects.filter(playlist_id__in=list(snapshots)).delete()
+            self.snapshot_model.objects.bulk_create([
+                self.snapshot_model(playlist_id=playlist_id, snapshot_id=snapshot_id, track_ids=track_ids)
+                for playlist_id, (snapshot_id, track_ids) in snapshots.items()
+            ])
@@ -0,0 +1,139 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import GenerationJob
+
+executor = None
+executor_lock = threading.Lock()
+# jobs left queued by a process that stopped before this one started are run again
+process_started = timezone.now()
+# the running jobs of this process have their heartbeat updated every heartbeat_seconds;
+# a running job without a heartbeat for stale_heartbeat_seconds belongs to a process that is gone
+heartbeat_seconds = 30
+stale_heartbeat_seconds = 5 * heartbeat_seconds
+running_job_ids = set()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Worker pool running generation jobs, settings.PLAYLIST_GENERATION_WORKERS at a time
+    """
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "PLAYLIST_GENERATION_WORKERS", 2),
+                thread_name_prefix="playlist-generation",
+            )
+            threading.Thread(target=beat, name="playlist-generation-heartbeat", daemon=True).start()
+        return executor
+
+
+def beat():
+    """
+    Update the heartbeat of the running jobs of this process every heartbeat_seconds
+    """
+    while True:
+        time.sleep(heartbeat_seconds)
+        with executor_lock:
+            job_ids = list(running_job_ids)
+        if job_ids:
+            try:
+                GenerationJob.objects.filter(id__in=job_ids, status=GenerationJob.RUNNING).update(
+                    heartbeat=timezone.now()
+                )
+            finally:
+                connection.close()
+
+
+def enqueue_job(intensity, session_length, genres, replace=False) -> GenerationJob:
+    """
+    Record a job generating a playlist for the preferences and hand it to the worker pool
+    once the job row is committed
+    """
+    job = GenerationJob.objects.create(
+        intensity=intensity,
+        session_length=session_length,
+        genres=genres,
+        replace=replace,
+    )
+    transaction.on_commit(lambda: get_executor().submit(run_job, job.id))
+    return job
+
+
+def update_job(job_id, **fields):
+    GenerationJob.objects.filter(id=job_id).update(updated=timezone.now(), **fields)
+
+
+def finish_job(job_id, **fields):
+    """
+    Record the outcome of a running job, unless recover_jobs has failed it in the meantime
+    """
+    GenerationJob.objects.filter(id=job_id, status=GenerationJob.RUNNING).update(updated=timezone.now(), **fields)
+
+
+def run_job(job_id):
+    """
+    Generate the playlist of job job_id, recording its phase as generation progresses and its playlist
+    or error once done
+    """
+    from cardio_playlist import MyCardioBeats, build_spotify_client
+
+    try:
+        # only the first worker handed a queued job runs it, should it be handed out again by recover_jobs
+        now = timezone.now()
+        claimed = GenerationJob.objects.filter(id=job_id, status=GenerationJob.QUEUED).update(
+            status=GenerationJob.RUNNING, updated=now, heartbeat=now
+        )
+        if not claimed:
+            return
+        with executor_lock:
+            running_job_ids.add(job_id)
+        job = GenerationJob.objects.get(id=job_id)
+
+        # raises SpotifyAuthorizationError without a stored token rather than prompting on the worker
+        spotify_client = build_spotify_client(open_browser=False)
+        mcb = MyCardioBeats(
+            intensity=job.intensity,
+            session_length=job.session_length,
+            genres=job.genres,
+            spotify_client=spotify_client,
+            on_phase=lambda phase: update_job(job_id, phase=phase),
+            replace_playlist=job.replace,
+        )
+        playlist_id = mcb.add_songs_to_playlist()
+        finish_job(job_id, status=GenerationJob.SUCCEEDED, playlist_id=playlist_id)
+    except Exception as e:
+        finish_job(job_id, status=GenerationJob.FAILED, error=repr(e))
+    finally:
+        with executor_lock:
+            running_job_ids.discard(job_id)
+        # every worker thread has its own database connection
+        connection.close()
+
+
+def recover_jobs():
+    """
+    Fail the running jobs whose process stopped, as their heartbeat is stale, and hand the jobs left queued
+    by a stopped process to the worker pool, so that no job stays queued or running forever after a restart.
+    Interrupted jobs are not run again since they may have published part of their playlist
+    """
+    if GenerationJob._meta.db_table not in connection.introspection.table_names():
+        # the database is not migrated yet, so there are no jobs
+        return
+
+    stale = timezone.now() - timedelta(seconds=stale_heartbeat_seconds)
+    GenerationJob.objects.filter(status=GenerationJob.RUNNING, heartbeat__lt=stale).update(
+        status=GenerationJob.FAILED, error="Interrupted by a server restart", updated=timezone.now()
+    )
+
+    queued_job_ids = GenerationJob.objects.filter(
+        status=GenerationJob.QUEUED, created__lt=process_started
+    ).values_list("id", flat=True)
+    for job_id in queued_job_ids:
+        get_executor().submit(run_job, job_id)
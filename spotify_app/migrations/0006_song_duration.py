@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0005_playlist_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='duration',
+            field=models.IntegerField(null=True, verbose_name='duration (ms)'),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='bpm',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='name',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0006_song_duration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+            ],
+            options={
+                'ordering': ['playlist', 'position'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['bpm', 'id'], name='spotify_app_bpm_e652a7_idx'),
+        ),
+        migrations.RemoveField(
+            model_name='song',
+            name='playlist_id',
+        ),
+        migrations.AddField(
+            model_name='playlisttrack',
+            name='playlist',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tracks', to='spotify_app.playlist'),
+        ),
+        migrations.AddField(
+            model_name='playlisttrack',
+            name='song',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='playlist_tracks', to='spotify_app.song'),
+        ),
+        migrations.AddConstraint(
+            model_name='playlisttrack',
+            constraint=models.UniqueConstraint(fields=('playlist', 'position'), name='unique_playlist_position'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0007_playlist_indexes_and_tracks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('intensity', models.CharField(max_length=20)),
+                ('session_length', models.PositiveIntegerField(verbose_name='session length (min)')),
+                ('genres', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('phase', models.CharField(blank=True, choices=[('fetch', 'Fetching genre playlists'), ('tempo', 'Resolving tempos'), ('sequence', 'Sequencing tracks'), ('publish', 'Publishing playlist')], default='', max_length=20)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='updated')),
+                ('heartbeat', models.DateTimeField(blank=True, null=True, verbose_name='heartbeat')),
+                ('playlist', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='spotify_app.playlist')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0008_generationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistSnapshot',
+            fields=[
+                ('playlist_id', models.CharField(max_length=200, primary_key=True, serialize=False)),
+                ('snapshot_id', models.CharField(max_length=200)),
+                ('track_ids', models.JSONField(default=list)),
+                ('synced', models.DateTimeField(auto_now=True, verbose_name='synced')),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0009_playlistsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='replace',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='preset',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='user_id',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='playlist',
+            index=models.Index(fields=['user_id', 'preset'], name='spotify_app_user_id_dd02bd_idx'),
+        ),
+    ]
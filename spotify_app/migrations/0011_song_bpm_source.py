@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0010_playlist_preset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='bpm_confidence',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='bpm_source',
+            field=models.CharField(choices=[('spotify', 'Spotify'), ('local', 'Detected from a local audio clip')], default='spotify', max_length=20),
+        ),
+    ]
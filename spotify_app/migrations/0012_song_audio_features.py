@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0011_song_bpm_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='danceability',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='energy',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='valence',
+            field=models.FloatField(null=True),
+        ),
+    ]
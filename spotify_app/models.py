@@ -1,21 +1,118 @@
+import uuid
+
 from django.db import models
 
 # Create your models here.
 
 
 class Song(models.Model):
+    SPOTIFY = "spotify"
+    LOCAL = "local"
+    BPM_SOURCE_CHOICES = [
+        (SPOTIFY, "Spotify"),
+        (LOCAL, "Detected from a local audio clip"),
+    ]
+
     id = models.CharField(max_length=200, primary_key=True)
-    bpm = models.FloatField()
+    # bpm is null when Spotify has no tempo for the track; the row is kept
+    # so that the track is not looked up again
+    bpm = models.FloatField(null=True)
+    # where bpm comes from, and for bpms detected by bpm_detection how confident the estimate is, from 0 to 1
+    bpm_source = models.CharField(max_length=20, choices=BPM_SOURCE_CHOICES, default=SPOTIFY)
+    bpm_confidence = models.FloatField(null=True)
+    # Spotify audio features from 0 to 1, null where Spotify has none; see similarity_index
+    energy = models.FloatField(null=True)
+    danceability = models.FloatField(null=True)
+    valence = models.FloatField(null=True)
     uri = models.CharField(max_length=200)
-    name = models.CharField(max_length=200)
-    playlist_id = models.ForeignKey(
-        "Playlist",
-        on_delete=models.SET_NULL,
-        null=True
-    )
+    name = models.CharField(max_length=200, blank=True, default="")
+    duration = models.IntegerField("duration (ms)", null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bpm", "id"]),
+        ]
 
 
 class Playlist(models.Model):
     id = models.CharField(max_length=200, primary_key=True)
     name = models.CharField(max_length=200)
     created = models.DateTimeField("created", auto_now_add=True)
+    # the Spotify user the playlist was generated for and the preferences it was generated from,
+    # so that generating it again can replace its tracks instead of creating another playlist
+    user_id = models.CharField(max_length=200, blank=True, default="")
+    preset = models.CharField(max_length=200, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user_id", "preset"]),
+        ]
+
+
+class PlaylistTrack(models.Model):
+    # a song's place in a generated playlist; a song can be in any number of playlists
+    playlist = models.ForeignKey(
+        "Playlist",
+        on_delete=models.CASCADE,
+        related_name="tracks"
+    )
+    song = models.ForeignKey(
+        "Song",
+        on_delete=models.CASCADE,
+        related_name="playlist_tracks"
+    )
+    position = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ["playlist", "position"]
+        constraints = [
+            models.UniqueConstraint(fields=["playlist", "position"], name="unique_playlist_position"),
+        ]
+
+
+class GenerationJob(models.Model):
+    # a request to generate a playlist, run by the worker pool in spotify_app.jobs
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+    PHASE_CHOICES = [
+        ("fetch", "Fetching genre playlists"),
+        ("tempo", "Resolving tempos"),
+        ("sequence", "Sequencing tracks"),
+        ("publish", "Publishing playlist"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    intensity = models.CharField(max_length=20)
+    session_length = models.PositiveIntegerField("session length (min)")
+    genres = models.JSONField(default=list)
+    # replace the tracks of the playlist generated before for the same preferences
+    replace = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    phase = models.CharField(max_length=20, choices=PHASE_CHOICES, blank=True, default="")
+    playlist = models.ForeignKey(
+        "Playlist",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField("created", auto_now_add=True)
+    updated = models.DateTimeField("updated", auto_now=True)
+    # last time the process running the job showed it is alive, see spotify_app.jobs
+    heartbeat = models.DateTimeField("heartbeat", null=True, blank=True)
+
+
+class PlaylistSnapshot(models.Model):
+    # the version of a genre playlist whose tracks were last synced, and those tracks in order
+    playlist_id = models.CharField(max_length=200, primary_key=True)
+    snapshot_id = models.CharField(max_length=200)
+    track_ids = models.JSONField(default=list)
+    synced = models.DateTimeField("synced", auto_now=True)
@@ -0,0 +1,25 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Playlist
+
+# cache key of the rendered index page with its ETag and Last-Modified
+index_cache_key = "spotify_app:index"
+# cache key of when a playlist was last saved or deleted
+playlists_changed_cache_key = "spotify_app:playlists_changed"
+
+
+@receiver(post_save, sender=Playlist)
+@receiver(post_delete, sender=Playlist)
+def invalidate_index(sender, **kwargs):
+    """
+    Drop the cached index page once the change to a playlist is committed,
+    so the page is not cached again from the state before the change
+    """
+    def invalidate():
+        cache.set(playlists_changed_cache_key, timezone.now(), timeout=None)
+        cache.delete(index_cache_key)
+
+    transaction.on_commit(invalidate)
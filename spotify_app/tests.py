@@ -1,3 +1,281 @@
-from django.test import TestCase
+import io
+import json
+import numpy as np
 
-# Create your tests here.
+from cardio_playlist import MyCardioBeats, cardio_playlists_ids
+from contextlib import redirect_stdout
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from fake_spotify.catalog import generate_catalog
+from fake_spotify.client import FakeSpotifyClient
+from fake_spotify.server import FakeSpotify
+from plan_cache import PlanCache
+from playlist_planner import milliseconds_per_minute, plan_session
+from playlist_publisher import PlaylistPublisher
+from similarity_index import SimilarityIndex, bpm_scale
+from tempo_cache import TempoCache, audio_feature_names
+from .models import Playlist, PlaylistTrack, Song
+
+
+class PlanSessionTests(SimpleTestCase):
+    max_bpm_step = 15
+    tolerance_ms = 30000
+
+    def random_pool(self, size, seed=0):
+        rng = np.random.default_rng(seed)
+        return rng.normal(120, 30, size).clip(50, 220), rng.integers(120000, 360000, size)
+
+    def plan(self, bpms, durations_ms, zone, minutes, **options):
+        return plan_session(
+            bpms,
+            durations_ms,
+            *zone,
+            minutes * milliseconds_per_minute,
+            max_bpm_step=self.max_bpm_step,
+            tolerance_ms=self.tolerance_ms,
+            **options
+        )
+
+    def assert_steps_within_limit(self, plan, bpms):
+        steps = np.abs(np.diff(plan.planned_bpms(bpms)))
+        self.assertLessEqual(steps.max(initial=0), self.max_bpm_step)
+
+    def test_large_pools_fill_the_session_in_small_steps(self):
+        for size in (10000, 200000):
+            bpms, durations_ms = self.random_pool(size)
+            for zone in ((120, 141), (142, 168), (169, 210)):
+                for minutes in (30, 45, 90):
+                    with self.subTest(size=size, zone=zone, minutes=minutes):
+                        plan = self.plan(bpms, durations_ms, zone, minutes)
+                        self.assert_steps_within_limit(plan, bpms)
+                        self.assertLessEqual(
+                            abs(plan.duration_ms - minutes * milliseconds_per_minute), self.tolerance_ms
+                        )
+                        self.assertEqual(plan.shortfall_ms, 0)
+                        self.assertEqual(len(set(plan.order)), len(plan.order))
+
+    def test_variants_keep_small_steps(self):
+        bpms, durations_ms = self.random_pool(10000, seed=1)
+        for seed in range(1, 6):
+            with self.subTest(seed=seed):
+                plan = self.plan(bpms, durations_ms, (142, 168), 45, seed=seed)
+                self.assert_steps_within_limit(plan, bpms)
+                self.assertEqual(plan.shortfall_ms, 0)
+
+    def test_folded_tempos_keep_small_steps(self):
+        # only tracks at half the zone tempo, planned at double their bpm
+        rng = np.random.default_rng(2)
+        bpms = rng.uniform(40, 90, 5000)
+        durations_ms = rng.integers(120000, 360000, 5000)
+        plan = self.plan(bpms, durations_ms, (142, 168), 45)
+        self.assert_steps_within_limit(plan, bpms)
+        self.assertEqual(plan.shortfall_ms, 0)
+        self.assertTrue(all(plan.multiples[position] == 2 for position in plan.hold))
+
+    def test_sparse_pool_reports_shortfall(self):
+        bpms = [85, 95, 100, 150, 160]
+        durations_ms = [200000] * len(bpms)
+        plan = self.plan(bpms, durations_ms, (142, 168), 30)
+        self.assert_steps_within_limit(plan, bpms)
+        self.assertEqual(plan.duration_ms, sum(durations_ms[position] for position in plan.order))
+        self.assertEqual(plan.shortfall_ms, 30 * milliseconds_per_minute - self.tolerance_ms - plan.duration_ms)
+
+    def test_empty_pool(self):
+        plan = self.plan([], [], (142, 168), 30)
+        self.assertEqual(plan.order, [])
+        self.assertEqual(plan.shortfall_ms, 30 * milliseconds_per_minute - self.tolerance_ms)
+
+
+class CreatePlaylistTests(SimpleTestCase):
+    def post_json(self, body):
+        return self.client.post(reverse("create_playlist"), json.dumps(body), content_type="application/json")
+
+    def test_body_must_be_an_object(self):
+        for body in ([], ["moderate", 30], "moderate", 30):
+            with self.subTest(body=body):
+                self.assertEqual(self.post_json(body).status_code, 400)
+
+    def test_genres_must_be_a_list(self):
+        for genres in ("rock", {"rock": True}, [1, 2]):
+            with self.subTest(genres=genres):
+                response = self.post_json({"intensity": "cardio", "session_length": 30, "genres": genres})
+                self.assertEqual(response.status_code, 400)
+
+    def test_genres_must_not_be_empty(self):
+        response = self.post_json({"intensity": "cardio", "session_length": 30, "genres": []})
+        self.assertEqual(response.status_code, 400)
+
+
+class SimilarityIndexTests(SimpleTestCase):
+    def test_nearest_matches_brute_force_with_exclusions(self):
+        rng = np.random.default_rng(3)
+        size = 20000
+        track_ids = [f"track{number}" for number in range(size)]
+        bpms = rng.uniform(60, 200, size)
+        features = rng.uniform(0, 1, (size, 3))
+        index = SimilarityIndex()
+        index.add_many(track_ids, bpms, [dict(zip(audio_feature_names, row)) for row in features])
+        index.rebuild()
+        points = np.column_stack([bpms / bpm_scale, features])
+        exclude = set(rng.choice(track_ids, 1000, replace=False).tolist())
+        excluded = np.array([track_id in exclude for track_id in track_ids])
+
+        for query in range(100):
+            with self.subTest(query=query):
+                low = rng.uniform(60, 190)
+                high = low + 10
+                vector = np.concatenate([[(low + high) / 2 / bpm_scale], rng.uniform(0, 1, 3)])
+                distances = ((points - vector) ** 2).sum(axis=1)
+                distances[excluded | (bpms <= low) | (bpms >= high)] = np.inf
+                expected = [track_ids[position] for position in np.argsort(distances)[:5]]
+                self.assertEqual(index.nearest(vector, 5, low, high, exclude), expected)
+
+
+class FakeSpotifyTestCase(TestCase):
+    genre = next(iter(cardio_playlists_ids))
+
+    def setUp(self):
+        self.fake_spotify = FakeSpotify(generate_catalog(track_count=400, playlist_size=150))
+        self.spotify_client = FakeSpotifyClient(self.fake_spotify)
+
+    def cardio_beats(self, **options) -> MyCardioBeats:
+        with redirect_stdout(io.StringIO()):
+            return MyCardioBeats(
+                intensity="cardio",
+                session_length=30,
+                genres=[self.genre],
+                spotify_client=self.spotify_client,
+                tempo_cache=TempoCache(),
+                plan_cache=PlanCache(),
+                similarity_index=SimilarityIndex(),
+                **options
+            )
+
+    def run_quietly(self, function, *args, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            return function(*args, **kwargs)
+
+
+class SnapshotSyncTests(FakeSpotifyTestCase):
+    def sync(self) -> MyCardioBeats:
+        self.spotify_client.calls = {}
+        mcb = self.cardio_beats()
+        self.run_quietly(mcb.populate_track_info)
+        return mcb
+
+    def test_unchanged_playlists_are_not_downloaded_again(self):
+        first = self.sync()
+        self.assertEqual(first.metrics.values.get("playlists_downloaded"), 1)
+
+        second = self.sync()
+        self.assertNotIn("GET playlists/items", self.spotify_client.calls)
+        self.assertEqual(second.metrics.values.get("playlists_unchanged"), 1)
+        self.assertEqual(sorted(second.track_store), sorted(first.track_store))
+
+    def test_changed_playlists_are_downloaded_again(self):
+        self.sync()
+        playlist = self.fake_spotify.catalog["playlists"][cardio_playlists_ids[self.genre]]
+        playlist["snapshot_id"] = "changed"
+        playlist["track_ids"] = playlist["track_ids"][:100]
+
+        mcb = self.sync()
+        self.assertIn("GET playlists/items", self.spotify_client.calls)
+        self.assertEqual(mcb.metrics.values.get("playlists_downloaded"), 1)
+        self.assertLessEqual(len(mcb.track_store), 100)
+
+
+class PlaylistPublisherTests(FakeSpotifyTestCase):
+    def user_playlist(self, track_ids) -> dict:
+        self.fake_spotify.user_playlists["mine"] = {"name": "Mine", "snapshot_id": "0", "track_ids": list(track_ids)}
+        return self.fake_spotify.user_playlists["mine"]
+
+    def test_chunks_are_added_in_order(self):
+        track_ids = list(self.fake_spotify.catalog["tracks"])[:250]
+        # duplicates are kept where they are
+        track_ids[200:210] = track_ids[:10]
+        playlist = self.user_playlist([])
+        uris = [f"spotify:track:{track_id}" for track_id in track_ids]
+
+        self.run_quietly(PlaylistPublisher(self.spotify_client).publish, "mine", uris)
+        self.assertEqual(playlist["track_ids"], track_ids)
+        self.assertEqual(self.spotify_client.calls, {"POST playlists/items": 3})
+
+    def test_replace_removes_the_old_tracks(self):
+        track_ids = list(self.fake_spotify.catalog["tracks"])[:250]
+        playlist = self.user_playlist(["old1", "old2"])
+        uris = [f"spotify:track:{track_id}" for track_id in track_ids]
+
+        self.run_quietly(PlaylistPublisher(self.spotify_client).publish, "mine", uris, replace=True)
+        self.assertEqual(playlist["track_ids"], track_ids)
+        self.assertEqual(self.spotify_client.calls, {"PUT playlists/items": 1, "POST playlists/items": 2})
+
+    def test_generating_again_with_replace_reuses_the_playlist(self):
+        first = self.cardio_beats()
+        playlist_id = self.run_quietly(first.add_songs_to_playlist)
+        first_track_ids = list(self.fake_spotify.user_playlists[playlist_id]["track_ids"])
+        self.assertTrue(first_track_ids)
+
+        second = self.cardio_beats(replace_playlist=True)
+        self.assertEqual(self.run_quietly(second.add_songs_to_playlist), playlist_id)
+        self.assertEqual(list(self.fake_spotify.user_playlists), [playlist_id])
+        self.assertEqual(len(self.fake_spotify.user_playlists[playlist_id]["track_ids"]), len(first_track_ids))
+
+
+class PlaylistPageTests(TestCase):
+    def setUp(self):
+        self.playlist = Playlist.objects.create(id="mine", name="Mine")
+        bpms = [120, 150, 150, 150, 90, None, 170, 120, 150, 100]
+        songs = Song.objects.bulk_create([
+            Song(id=f"song{number}", bpm=bpm, uri=f"spotify:track:song{number}", name=f"Song {number}")
+            for number, bpm in enumerate(bpms)
+        ])
+        PlaylistTrack.objects.bulk_create([
+            PlaylistTrack(playlist=self.playlist, song=song, position=position)
+            for position, song in enumerate(songs)
+        ])
+
+    def get_page(self, url) -> dict:
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_pages_follow_on_by_descending_bpm_then_id(self):
+        expected = [
+            song_id
+            for song_id, _ in sorted(
+                Song.objects.filter(bpm__isnull=False).values_list("id", "bpm"),
+                key=lambda song: (-song[1], song[0]),
+            )
+        ]
+        song_ids = []
+        url = reverse("playlist", args=["mine"]) + "?limit=2"
+        while url is not None:
+            page = self.get_page(url)
+            self.assertLessEqual(len(page["songs"]), 2)
+            song_ids.extend(song["id"] for song in page["songs"])
+            url = page["next"]
+
+        self.assertEqual(song_ids, expected)
+
+    def test_unknown_playlist(self):
+        self.assertEqual(self.client.get(reverse("playlist", args=["unknown"])).status_code, 404)
+
+
+class IndexPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_conditional_gets_are_answered_with_304_until_a_playlist_changes(self):
+        response = self.client.get(reverse("index"))
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        self.assertEqual(self.client.get(reverse("index"), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Playlist.objects.create(id="mine", name="Mine")
+        response = self.client.get(reverse("index"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertContains(response, "Mine")
@@ -3,6 +3,8 @@ from . import views
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('create_playlist/', views.create_playlist, name='create_playlist'),
+    path('jobs/<uuid:job_id>/', views.job_status, name='job_status'),
+    path('metrics/', views.metrics, name='metrics'),
     path('<str:playlist_id>/', views.playlist, name='playlist'),
-    path('/create_playlist/', views.create_playlist, name='create_playlist')
 ]
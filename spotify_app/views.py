@@ -1,21 +1,187 @@
-from django.http import HttpResponse
-from .models import Playlist, Song
-from django.shortcuts import render
+import hashlib
+import json
+
+from cardio_playlist import validate_preferences
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+from metrics import get_metrics
+from .jobs import enqueue_job
+from .models import GenerationJob, Playlist, PlaylistTrack
+from .signals import index_cache_key, playlists_changed_cache_key
+from urllib.parse import urlencode
 
 # Create your views here.
 
+# songs per page of the playlist endpoint unless ?limit= asks for fewer or more
+default_page_size = 100
+max_page_size = 1000
+
+
+def index_page() -> dict:
+    """
+    The rendered index page with its ETag and Last-Modified, from the cache or rendered and cached
+    until a playlist is saved or deleted
+    """
+    page = cache.get(index_cache_key)
+    if page is None:
+        all_playlists = list(Playlist.objects.order_by('-created')[:10])
+        context = {'all_playlists': all_playlists}
+        content = render_to_string('spotify_app/index.html', context)
+
+        last_modified = all_playlists[0].created if all_playlists else None
+        # a deleted playlist changes the page without changing the newest created
+        changed = cache.get(playlists_changed_cache_key)
+        if changed is not None and (last_modified is None or changed > last_modified):
+            last_modified = changed
+
+        page = {
+            "content": content,
+            "etag": hashlib.md5(content.encode()).hexdigest(),
+            "last_modified": last_modified,
+        }
+        cache.set(index_cache_key, page, timeout=None)
+
+    return page
 
+
+def request_index_page(request) -> dict:
+    """
+    index_page() read once per request, for the conditional GET checks and the response alike
+    """
+    if not hasattr(request, "index_page"):
+        request.index_page = index_page()
+    return request.index_page
+
+
+@condition(
+    etag_func=lambda request: request_index_page(request)["etag"],
+    last_modified_func=lambda request: request_index_page(request)["last_modified"],
+)
 def index(request):
-    all_playlists = Playlist.objects.order_by('-created')[:10]
-    context = {'all_playlists': all_playlists}
-    return render(request, 'spotify_app/index.html', context)
+    return HttpResponse(request_index_page(request)["content"])
 
 
+@csrf_exempt
+@require_POST
 def create_playlist(request):
-    return HttpResponse("You're at the page for creating a new playlist.")
+    """
+    Enqueue a job generating a playlist for the intensity, session_length, genres and optionally replace
+    given as a JSON body or form fields, and answer at once with the job id and where to follow its progress
+    """
+    if request.content_type == "application/json":
+        try:
+            preferences = json.loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest("The request body is not valid JSON")
+        if not isinstance(preferences, dict):
+            return HttpResponseBadRequest("The request body must be a JSON object")
+        genres = preferences.get("genres") or []
+        if not isinstance(genres, list) or not all(isinstance(genre, str) for genre in genres):
+            return HttpResponseBadRequest("genres must be a list of genre names")
+        replace = bool(preferences.get("replace", False))
+    else:
+        preferences = request.POST
+        genres = preferences.getlist("genres")
+        replace = preferences.get("replace", "") in ("1", "true", "on")
+
+    try:
+        intensity, session_length, genres = validate_preferences(
+            preferences.get("intensity"),
+            preferences.get("session_length"),
+            genres,
+        )
+    except (TypeError, ValueError) as e:
+        return HttpResponseBadRequest(str(e))
+
+    job = enqueue_job(intensity, session_length, genres, replace=replace)
+    return JsonResponse(
+        {"job": str(job.id), "status": job.status, "status_url": reverse("job_status", args=[job.id])},
+        status=202
+    )
+
+
+def job_status(request, job_id):
+    """
+    Status of a playlist generation job: queued, running through generation_phases, succeeded or failed
+    """
+    job = get_object_or_404(GenerationJob, id=job_id)
+    return JsonResponse({
+        "job": str(job.id),
+        "status": job.status,
+        "phase": job.phase or None,
+        "playlist": job.playlist_id,
+        "error": job.error or None,
+        "created": job.created.isoformat(),
+        "updated": job.updated.isoformat(),
+    })
+
+
+@require_GET
+def metrics(request):
+    """
+    Metrics of the playlists generated by this process in the Prometheus text format
+    """
+    return HttpResponse(get_metrics().to_prometheus(), content_type="text/plain; version=0.0.4")
+
+
+def encode_cursor(bpm, song_id) -> str:
+    return f"{bpm!r}:{song_id}"
+
+
+def decode_cursor(cursor):
+    bpm, song_id = cursor.split(":", 1)
+    return float(bpm), song_id
 
 
 def playlist(request, playlist_id):
-    all_songs = Song.objects.order_by("-bpm")
-    all_song_names = [song.name for song in all_songs]
-    return HttpResponse(all_song_names)
+    """
+    The songs of playlist_id as JSON, by descending bpm then id, one page at a time.
+    Pages are keyed on the (bpm, id) of the last song of the previous page, given as ?after=,
+    so deep pages do not skip over the songs of the pages before them. The tracks are found through the
+    playlist index of PlaylistTrack and sorted, which is cheap for the few hundred tracks of a playlist
+    """
+    try:
+        limit = min(max_page_size, max(1, int(request.GET.get("limit", default_page_size))))
+        after = request.GET.get("after")
+        cursor = decode_cursor(after) if after else None
+    except ValueError:
+        return HttpResponseBadRequest("limit must be an integer and after a cursor returned as next")
+
+    if not Playlist.objects.filter(id=playlist_id).exists():
+        raise Http404("No playlist with this id")
+
+    tracks = PlaylistTrack.objects.filter(playlist_id=playlist_id, song__bpm__isnull=False)
+    if cursor is not None:
+        after_bpm, after_id = cursor
+        tracks = tracks.filter(Q(song__bpm__lt=after_bpm) | Q(song__bpm=after_bpm, song_id__gt=after_id))
+    rows = tracks.order_by("-song__bpm", "song_id").values_list(
+        "song_id", "song__name", "song__bpm", "song__uri"
+    )[:limit]
+
+    def stream_page():
+        yield '{"playlist": %s, "songs": [' % json.dumps(playlist_id)
+        count = 0
+        last_row = None
+        for row in rows.iterator(chunk_size=max_page_size):
+            yield ("," if count else "") + json.dumps(
+                {"id": row[0], "name": row[1], "bpm": row[2], "uri": row[3]},
+                separators=(",", ":"),
+            )
+            count += 1
+            last_row = row
+
+        next_url = None
+        if count == limit:
+            next_url = request.path + "?" + urlencode({
+                "limit": limit,
+                "after": encode_cursor(last_row[2], last_row[0]),
+            })
+        yield '], "next": %s}' % json.dumps(next_url)
+
+    return StreamingHttpResponse(stream_page(), content_type="application/json")
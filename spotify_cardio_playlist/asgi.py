@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotify_cardio_playlist.settings')
 
 application = get_asgi_application()
+
+# jobs the previous server process left queued or running would otherwise never finish
+from spotify_app.jobs import recover_jobs  # noqa: E402
+
+recover_jobs()
@@ -124,3 +124,20 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# the index page is cached until a playlist changes; with several server processes use a shared
+# backend such as memcached so that every process sees the invalidation
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Playlist generation jobs
+# number of playlists spotify_app.jobs generates at the same time
+
+PLAYLIST_GENERATION_WORKERS = 2
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spotify_cardio_playlist.settings')
 
 application = get_wsgi_application()
+
+# jobs the previous server process left queued or running would otherwise never finish
+from spotify_app.jobs import recover_jobs  # noqa: E402
+
+recover_jobs()
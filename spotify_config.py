@@ -0,0 +1,60 @@
+import os
+import threading
+
+from importlib.machinery import PathFinder
+from importlib.util import module_from_spec
+from types import ModuleType
+from typing import NamedTuple, Optional
+
+# Base URLs of the Spotify Web API and accounts service. Point them at a stand-in server,
+# e.g. python -m fake_spotify.server, to run without Spotify:
+#   SPOTIFY_API_URL=http://localhost:8765/v1/ SPOTIFY_ACCOUNTS_URL=http://localhost:8765/ SPOTIFY_ACCESS_TOKEN=offline
+spotify_api_url = os.environ.get("SPOTIFY_API_URL", "https://api.spotify.com/v1/")
+spotify_accounts_url = os.environ.get("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com/")
+
+# Static access token used instead of the OAuth flow when set
+spotify_access_token = os.environ.get("SPOTIFY_ACCESS_TOKEN")
+
+
+class Credentials(NamedTuple):
+    client_id: Optional[str]
+    client_secret: Optional[str]
+    user_id: str
+    redirect_uri: Optional[str]
+    scopes: Optional[str]
+
+
+def load_secrets() -> Optional[ModuleType]:
+    """
+    The secrets module with the credentials, if there is one on the path. It is loaded from its file,
+    as by the time credentials are first needed the standard library module of the same name
+    may have been imported in its place
+    """
+    spec = PathFinder.find_spec("secrets")
+    if spec is None:
+        return None
+
+    secrets = module_from_spec(spec)
+    spec.loader.exec_module(secrets)
+    return secrets if all(hasattr(secrets, name) for name in Credentials._fields) else None
+
+
+credentials = None
+credentials_lock = threading.Lock()
+
+
+def get_credentials() -> Credentials:
+    """
+    Return the app credentials and user of the secrets module, loaded on first use so that runs needing
+    no authorization, such as a dry run, start without it
+    """
+    global credentials
+    with credentials_lock:
+        if credentials is None:
+            secrets = load_secrets()
+            if secrets is not None:
+                credentials = Credentials(*(getattr(secrets, name) for name in Credentials._fields))
+            else:
+                # no secrets module with credentials; only a static access token can be used
+                credentials = Credentials(None, None, os.environ.get("SPOTIFY_USER_ID", "offline_user"), None, None)
+        return credentials
@@ -0,0 +1,121 @@
+import os
+
+from track_store import TrackStore
+from typing import Iterable, Optional
+
+# the Spotify audio features cached with the tempos, as named by the audio features endpoint and the Song model
+audio_feature_names = ("energy", "danceability", "valence")
+
+
+def setup_django():
+    """
+    Configure Django so that the spotify_app models can be used outside of manage.py
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "spotify_cardio_playlist.settings")
+
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+class TempoCache:
+    """
+    Read-through cache of track tempos and metadata, persisted in the spotify_app Song table.
+    Tracks Spotify returned no tempo for are stored with a null bpm so they are never looked up again.
+    """
+
+    # SQLite limits the number of parameters in a single query
+    query_batch_size = 500
+
+    def __init__(self):
+        setup_django()
+        from spotify_app.models import Song
+
+        self.song_model = Song
+        self.tracks = TrackStore()
+        self.pending_ids = set()
+        # track id -> (bpm source, confidence) of the pending tracks
+        self.pending_sources = {}
+        # track id -> audio features of the pending tracks, see audio_feature_names
+        self.pending_features = {}
+
+    def __contains__(self, track_id) -> bool:
+        return track_id in self.tracks
+
+    def load(self, track_ids: Iterable[str]):
+        """
+        Load the cached rows for track_ids into memory, one query per batch of ids
+        """
+        missing_ids = [
+            track_id
+            for track_id in track_ids
+            if track_id not in self.tracks
+        ]
+
+        for start in range(0, len(missing_ids), self.query_batch_size):
+            rows = self.song_model.objects.filter(
+                id__in=missing_ids[start:start + self.query_batch_size]
+            ).values_list("id", "bpm", "uri", "duration", "name")
+
+            for track_id, bpm, uri, duration, name in rows:
+                self.tracks.add(track_id, uri, duration, name)
+                self.tracks.set_bpm(track_id, bpm)
+
+    def get_bpm(self, track_id) -> Optional[float]:
+        """
+        Return the cached bpm of track_id; load(track_id) must have found it first
+        """
+        return self.tracks.bpm(track_id)
+
+    def set(self, track_id, bpm, uri="", duration=None, name="", source=None, confidence=None, features=None):
+        """
+        Cache the bpm and metadata of track_id; written to the database on flush().
+        source defaults to Spotify; a bpm from another source replaces the one cached before.
+        features is a dict of Spotify audio features, of which audio_feature_names are kept
+        """
+        self.tracks.remove(track_id)
+        self.tracks.add(track_id, uri, duration, name)
+        self.tracks.set_bpm(track_id, bpm)
+        self.pending_ids.add(track_id)
+        self.pending_sources[track_id] = (source or self.song_model.SPOTIFY, confidence)
+        if features:
+            self.pending_features[track_id] = {name: features.get(name) for name in audio_feature_names}
+
+    def flush(self):
+        """
+        Write all tracks cached since the last flush in bulk
+        """
+        if not self.pending_ids:
+            return
+
+        tracks = [self.tracks.get(track_id) for track_id in self.pending_ids]
+        songs = [
+            self.song_model(
+                id=track.id,
+                bpm=self.tracks.bpm(track.id),
+                uri=track.uri,
+                duration=track.duration or None,
+                name=track.name[:200],
+                bpm_source=self.pending_sources[track.id][0],
+                bpm_confidence=self.pending_sources[track.id][1],
+                **self.pending_features.get(track.id, {}),
+            )
+            for track in tracks
+        ]
+        self.song_model.objects.bulk_create(
+            songs,
+            batch_size=self.query_batch_size,
+            ignore_conflicts=True
+        )
+        # Spotify tempos are only ever inserted; other sources fill in rows Spotify had no tempo for
+        detected_songs = [song for song in songs if song.bpm_source != self.song_model.SPOTIFY]
+        self.song_model.objects.bulk_update(
+            detected_songs,
+            ["bpm", "bpm_source", "bpm_confidence"],
+            batch_size=self.query_batch_size
+        )
+        self.pending_ids.clear()
+        self.pending_sources.clear()
+        self.pending_features.clear()
@@ -0,0 +1,255 @@
+import base64
+import fcntl
+import json
+import os
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from exceptions import SpotifyAuthorizationError
+from spotify_config import get_credentials, spotify_accounts_url
+from typing import Callable, Optional
+
+token_url = f'{spotify_accounts_url}api/token'
+# where spotipy's OAuth flow cached the token of the user before tokens were stored by TokenManager
+spotipy_cache_path = ".cache"
+
+
+def client_credentials_headers() -> dict:
+    credentials = get_credentials()
+    encoded_credentials = base64.b64encode(
+        credentials.client_id.encode() + b':' + credentials.client_secret.encode()
+    ).decode("utf-8")
+
+    return {
+        "Authorization": "Basic " + encoded_credentials,
+        "Content-Type": "application/x-www-form-urlencoded"
+    }
+
+
+def request_token(request_body) -> dict:
+    """
+    POST request_body to the token endpoint with the client credentials and return the token in the response
+    """
+    from http_session import check_response, get_spotify_session
+
+    token_response = get_spotify_session().post(
+        token_url,
+        data=request_body,
+        headers=client_credentials_headers(),
+    )
+    check_response(token_response, "Invalid token response. ")
+
+    token_response_json = token_response.json()
+    if token_response_json.get("access_token", None) is None:
+        raise Exception("Invalid token response")
+
+    return token_response_json
+
+
+class Token:
+    def __init__(self, access_token, expires_in, refresh_token):
+        self.access_token = access_token
+        self.created = datetime.now()
+        self.expires = self.created + timedelta(seconds=expires_in)
+        self.refresh_token = refresh_token
+
+    def update(self, access_token, expires_in):
+        self.access_token = access_token
+        self.last_modified = datetime.now()
+        self.expires = self.last_modified + timedelta(seconds=expires_in)
+
+    def refresh(self):
+        token_response_json = request_token({
+            "grant_type": "refresh_token",
+            "refresh_token": self.refresh_token,
+        })
+
+        self.update(
+            token_response_json["access_token"],
+            token_response_json["expires_in"]
+        )
+        # Spotify may rotate the refresh token
+        self.refresh_token = token_response_json.get("refresh_token", self.refresh_token)
+
+    def to_dict(self) -> dict:
+        return {
+            "access_token": self.access_token,
+            "expires": self.expires.isoformat(),
+            "refresh_token": self.refresh_token,
+        }
+
+    @classmethod
+    def from_dict(cls, token_dict) -> "Token":
+        token = cls(token_dict["access_token"], 0, token_dict["refresh_token"])
+        token.expires = datetime.fromisoformat(token_dict["expires"])
+        return token
+
+
+class TokenManager:
+    """
+    Shares one Spotify access token between threads, and between worker processes through a JSON file.
+    The token is refreshed refresh_ahead before it expires by whichever caller gets to it first;
+    the others wait on the lock and read the refreshed token instead of refreshing it again
+    """
+
+    def __init__(
+        self,
+        token_path=".spotify_token.json",
+        refresh_ahead=timedelta(minutes=5),
+        load_token: Optional[Callable[[], Optional[Token]]] = None,
+    ):
+        self.token_path = token_path
+        self.refresh_ahead = refresh_ahead
+        # called for an initial token when none has been stored yet
+        self.load_token = load_token
+        self.token = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def store_lock(self):
+        """
+        Hold an exclusive lock on the token file across processes
+        """
+        with open(self.token_path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_store(self) -> Optional[Token]:
+        if not os.path.exists(self.token_path):
+            return None
+
+        with open(self.token_path) as token_file:
+            return Token.from_dict(json.load(token_file))
+
+    def write_store(self, token: Token):
+        temporary_path = self.token_path + ".tmp"
+        # only readable by the user running the workers
+        file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file_descriptor, "w") as token_file:
+            json.dump(token.to_dict(), token_file)
+        os.replace(temporary_path, self.token_path)
+
+    def needs_refresh(self, token: Token) -> bool:
+        return token.expires - self.refresh_ahead <= datetime.now()
+
+    def has_token(self) -> bool:
+        return self.token is not None or os.path.exists(self.token_path)
+
+    def save(self, token: Token):
+        with self.lock, self.store_lock():
+            self.write_store(token)
+            self.token = token
+
+    def get_access_token(self) -> str:
+        with self.lock:
+            if self.token is None or self.needs_refresh(self.token):
+                self.token = self.load_fresh_token(stale_access_token=None)
+
+            return self.token.access_token
+
+    def refresh(self, stale_access_token) -> str:
+        """
+        Refresh the token after stale_access_token was rejected, unless another thread or process already has
+        """
+        with self.lock:
+            self.token = self.load_fresh_token(stale_access_token=stale_access_token)
+            return self.token.access_token
+
+    def load_fresh_token(self, stale_access_token) -> Token:
+        with self.store_lock():
+            token = self.read_store()
+            stored = token is not None
+            if token is None and self.load_token is not None:
+                token = self.load_token()
+            if token is None:
+                raise SpotifyAuthorizationError(
+                    "No Spotify token available; run python cardio_playlist.py once to authorize the app "
+                    "in a browser, or set SPOTIFY_ACCESS_TOKEN"
+                )
+
+            if self.needs_refresh(token) or token.access_token == stale_access_token:
+                print("Refreshing Spotify access token...")
+                token.refresh()
+                stored = False
+
+            # a token that cannot be refreshed, such as the static SPOTIFY_ACCESS_TOKEN, is kept out of the
+            # store, so that later runs without it load a token of their own rather than one they cannot refresh
+            if not stored and token.refresh_token is not None:
+                self.write_store(token)
+
+            return token
+
+    def headers(self) -> dict:
+        return {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.get_access_token()}",
+        }
+
+
+class TokenManagerAuth:
+    """
+    Auth manager for spotipy.Spotify taking its access tokens from token_manager,
+    so that the client shares the tokens and refreshes of every other Spotify request
+    """
+
+    def __init__(self, token_manager: TokenManager):
+        self.token_manager = token_manager
+
+    def get_access_token(self, as_dict=False) -> str:
+        return self.token_manager.get_access_token()
+
+
+def exchange_code(code) -> Token:
+    """
+    Token for the authorization code Spotify redirected the user back with
+    """
+    token_response_json = request_token({
+        "grant_type": "authorization_code",
+        "code": code,
+        "redirect_uri": get_credentials().redirect_uri,
+    })
+    return Token(
+        token_response_json["access_token"],
+        token_response_json["expires_in"],
+        token_response_json["refresh_token"],
+    )
+
+
+def authorize_interactively(open_browser=True) -> Token:
+    """
+    Ask the user to authorize the app through spotipy's OAuth flow, which opens the authorization page and
+    receives or prompts for the URL Spotify redirects back to, and exchange the code in it for a token
+    """
+    from spotipy.oauth2 import SpotifyOAuth
+
+    print("Getting Spotify authorization token...")
+    credentials = get_credentials()
+    oauth = SpotifyOAuth(
+        client_id=credentials.client_id,
+        client_secret=credentials.client_secret,
+        redirect_uri=credentials.redirect_uri,
+        scope=credentials.scopes,
+        state=base64.urlsafe_b64encode(os.urandom(12)).decode(),
+        open_browser=open_browser,
+    )
+    return exchange_code(oauth.get_authorization_code())
+
+
+def cached_spotipy_token(cache_path=spotipy_cache_path) -> Optional[Token]:
+    """
+    Token cached by spotipy's OAuth flow in cache_path, if there is one
+    """
+    if not os.path.exists(cache_path):
+        return None
+
+    with open(cache_path) as cache_file:
+        token_info = json.load(cache_file)
+
+    token = Token(token_info["access_token"], 0, token_info.get("refresh_token"))
+    token.expires = datetime.fromtimestamp(token_info["expires_at"])
+    return token
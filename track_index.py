@@ -0,0 +1,106 @@
+from bisect import bisect_left, bisect_right
+from typing import Iterator, List, Optional
+
+
+class BpmIndex:
+    """
+    Tracks sorted by bpm, supporting range queries in O(log n) and removal in O(1).
+    Removed tracks are skipped through path-compressed pointers to the next and previous remaining tracks,
+    so repeated queries over a window of removed tracks stay cheap
+    """
+
+    def __init__(self, tracks: List[dict]):
+        self.tracks = sorted(tracks, key=lambda track: track["bpm"])
+        self.bpms = [track["bpm"] for track in self.tracks]
+        # next_remaining[i] == i while self.tracks[i] has not been removed;
+        # the extra last slot marks the end of the index
+        self.next_remaining = list(range(len(self.tracks) + 1))
+        # previous_remaining[i + 1] == i + 1 while self.tracks[i] has not been removed;
+        # the extra first slot marks the start of the index
+        self.previous_remaining = list(range(len(self.tracks) + 1))
+        self.size = len(self.tracks)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def find_remaining(self, index) -> int:
+        """
+        Return the position of the first remaining track at or after index
+        """
+        return self.follow(self.next_remaining, index)
+
+    def find_previous_remaining(self, index) -> int:
+        """
+        Return the position of the last remaining track before index, or -1
+        """
+        return self.follow(self.previous_remaining, index) - 1
+
+    @staticmethod
+    def follow(pointers, index) -> int:
+        remaining = index
+        while pointers[remaining] != remaining:
+            remaining = pointers[remaining]
+
+        while pointers[index] != remaining:
+            pointers[index], index = remaining, pointers[index]
+
+        return remaining
+
+    def first_in_range(self, low_bpm, high_bpm) -> Optional[int]:
+        """
+        Return the position of the remaining track with the lowest bpm strictly between low_bpm and high_bpm
+        """
+        index = self.find_remaining(bisect_right(self.bpms, low_bpm))
+        if index < len(self.tracks) and self.bpms[index] < high_bpm:
+            return index
+
+        return None
+
+    def last_in_range(self, low_bpm, high_bpm) -> Optional[int]:
+        """
+        Return the position of the remaining track with the highest bpm strictly between low_bpm and high_bpm
+        """
+        index = self.find_previous_remaining(bisect_left(self.bpms, high_bpm))
+        if index >= 0 and self.bpms[index] > low_bpm:
+            return index
+
+        return None
+
+    def iter_range(self, low_bpm, high_bpm) -> Iterator[int]:
+        """
+        Yield the positions of the remaining tracks strictly between low_bpm and high_bpm by ascending bpm
+        """
+        index = self.first_in_range(low_bpm, high_bpm)
+        while index is not None and self.bpms[index] < high_bpm:
+            yield index
+            index = self.find_remaining(index + 1)
+            if index == len(self.tracks):
+                index = None
+
+    def remove(self, index):
+        if self.next_remaining[index] == index:
+            self.next_remaining[index] = index + 1
+            self.previous_remaining[index + 1] = index
+            self.size -= 1
+
+    def pop_first_in_range(self, low_bpm, high_bpm) -> Optional[dict]:
+        """
+        Remove and return the track with the lowest bpm strictly between low_bpm and high_bpm
+        """
+        index = self.first_in_range(low_bpm, high_bpm)
+        if index is None:
+            return None
+
+        self.remove(index)
+        return self.tracks[index]
+
+    def pop_last_in_range(self, low_bpm, high_bpm) -> Optional[dict]:
+        """
+        Remove and return the track with the highest bpm strictly between low_bpm and high_bpm
+        """
+        index = self.last_in_range(low_bpm, high_bpm)
+        if index is None:
+            return None
+
+        self.remove(index)
+        return self.tracks[index]
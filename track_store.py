@@ -0,0 +1,133 @@
+import math
+import numpy as np
+import sys
+
+from typing import Iterator, NamedTuple, Optional
+
+
+class TrackRecord(NamedTuple):
+    id: str
+    uri: str
+    duration: int
+    name: str
+
+
+class TrackStore:
+    """
+    Tracks kept column-wise: interned id, uri and name strings in lists and bpms and durations in NumPy arrays,
+    one row per track in the order tracks were added. Removed tracks keep their row and are masked out,
+    so row numbers handed out stay valid. Tracks without a known bpm have a NaN bpm
+    """
+
+    def __init__(self, capacity=1024):
+        self.ids = []
+        self.uris = []
+        self.names = []
+        self.bpms = np.full(capacity, np.nan)
+        self.durations = np.zeros(capacity, dtype=np.int64)
+        self.present = np.zeros(capacity, dtype=bool)
+        # track id -> row
+        self.rows = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, track_id) -> bool:
+        row = self.rows.get(track_id)
+        return row is not None and bool(self.present[row])
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Iterate over the ids of the tracks in the store, in the order they were added
+        """
+        for row in np.flatnonzero(self.present[:len(self.ids)]).tolist():
+            yield self.ids[row]
+
+    def grow(self):
+        capacity = 2 * len(self.bpms)
+        self.bpms = np.concatenate([self.bpms, np.full(capacity - len(self.bpms), np.nan)])
+        self.durations = np.concatenate([self.durations, np.zeros(capacity - len(self.durations), dtype=np.int64)])
+        self.present = np.concatenate([self.present, np.zeros(capacity - len(self.present), dtype=bool)])
+
+    def add(self, track_id, uri, duration, name="") -> int:
+        """
+        Add a track without a bpm, unless it is already in the store, and return its row.
+        A removed track is added back in its old row
+        """
+        row = self.rows.get(track_id)
+        if row is not None and self.present[row]:
+            return row
+
+        if row is None:
+            row = len(self.ids)
+            if row == len(self.bpms):
+                self.grow()
+
+            self.ids.append(sys.intern(track_id))
+            self.uris.append(None)
+            self.names.append(None)
+            self.rows[self.ids[row]] = row
+
+        self.uris[row] = sys.intern(uri or "")
+        self.names[row] = name or ""
+        self.durations[row] = duration or 0
+        self.bpms[row] = np.nan
+        self.present[row] = True
+        self.size += 1
+
+        return row
+
+    def remove(self, track_id):
+        row = self.rows.get(track_id)
+        if row is not None and self.present[row]:
+            self.present[row] = False
+            self.size -= 1
+
+    def set_bpm(self, track_id, bpm):
+        self.bpms[self.rows[track_id]] = np.nan if bpm is None else bpm
+
+    def bpm(self, track_id) -> Optional[float]:
+        bpm = float(self.bpms[self.rows[track_id]])
+        return None if math.isnan(bpm) else bpm
+
+    def get(self, track_id) -> Optional[TrackRecord]:
+        if track_id not in self:
+            return None
+
+        row = self.rows[track_id]
+        return TrackRecord(self.ids[row], self.uris[row], int(self.durations[row]), self.names[row])
+
+    def all_rows(self) -> np.ndarray:
+        return np.flatnonzero(self.present[:len(self.ids)])
+
+    def rows_in_bpm_range(self, low, high) -> np.ndarray:
+        """
+        Rows of the tracks whose bpm is strictly between low and high
+        """
+        count = len(self.ids)
+        bpms = self.bpms[:count]
+        return np.flatnonzero(self.present[:count] & (low < bpms) & (bpms < high))
+
+    def total_duration(self, rows=None) -> int:
+        """
+        Total duration in ms of the tracks in rows, or of every track in the store
+        """
+        if rows is None:
+            rows = self.all_rows()
+        return int(self.durations[rows].sum())
+
+    def uris_of(self, rows) -> list:
+        return [self.uris[row] for row in rows]
+
+    def rows_of_uris(self, uris) -> np.ndarray:
+        """
+        Rows of the tracks in the store with uris, in the order of uris
+        """
+        wanted_uris = set(uris)
+        rows_by_uri = {
+            self.uris[row]: row
+            for row in self.all_rows().tolist()
+            if self.uris[row] in wanted_uris
+        }
+        return np.array([rows_by_uri[uri] for uri in uris if uri in rows_by_uri], dtype=np.int64)